@@ -0,0 +1,145 @@
+#admission.py
+
+import asyncio
+import collections
+import contextlib
+import math
+import time
+
+import config as _config
+
+
+class Rejected(Exception):
+    """The run queue is full; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Too many assistant runs are queued, please try again shortly.")
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """A granted run slot. release() is idempotent."""
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(time.monotonic() - self._started)
+
+
+class AdmissionController:
+    """Caps concurrent assistant runs and queues the rest fairly per user.
+
+    Waiting requests are kept in one FIFO per user and slots are handed out
+    round-robin across users, so a user with many queued messages only
+    delays their own. When the queue (or a user's share of it) is full new
+    requests are rejected with a Retry-After estimate instead of piling up.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, max_queue_per_user: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self._active = 0
+        self._queued = 0
+        # username -> deque of waiting futures; dict order is the round-robin order
+        self._queues = collections.OrderedDict()
+        # Exponentially weighted average run time, used for Retry-After
+        self._avg_run = 10.0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self._avg_run * (self._queued + 1) / self.max_concurrent))
+
+    def _record_wait(self, waited: float):
+        self.admitted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    async def acquire(self, username: str) -> Ticket:
+        if self._active < self.max_concurrent and not self._queued:
+            self._active += 1
+            self._record_wait(0.0)
+            return Ticket(self)
+
+        queue = self._queues.get(username)
+        if self._queued >= self.max_queue or (queue and len(queue) >= self.max_queue_per_user):
+            self.rejected += 1
+            raise Rejected(self._retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        if queue is None:
+            queue = self._queues[username] = collections.deque()
+        queue.append(future)
+        self._queued += 1
+        queued_at = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted a slot just as the caller went away; pass it on.
+                self._release(0.0)
+            else:
+                self._remove(username, future)
+            raise
+        self._record_wait(time.monotonic() - queued_at)
+        return Ticket(self)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, username: str):
+        ticket = await self.acquire(username)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def _remove(self, username: str, future):
+        queue = self._queues.get(username)
+        if queue and future in queue:
+            queue.remove(future)
+            self._queued -= 1
+            if not queue:
+                del self._queues[username]
+
+    def _release(self, run_time: float):
+        self._active -= 1
+        if run_time:
+            self._avg_run = 0.8 * self._avg_run + 0.2 * run_time
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._active < self.max_concurrent and self._queues:
+            username, queue = self._queues.popitem(last=False)
+            future = queue.popleft()
+            self._queued -= 1
+            if queue:
+                # Back of the line until every other waiting user had a turn
+                self._queues[username] = queue
+            if future.cancelled():
+                continue
+            self._active += 1
+            future.set_result(None)
+
+    def stats(self):
+        return {
+            "active": self._active,
+            "queued": self._queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_seconds_avg": self.wait_total / self.admitted if self.admitted else 0.0,
+            "wait_seconds_max": self.wait_max,
+        }
+
+
+controller = AdmissionController(
+    max_concurrent=_config.ASSISTANT_MAX_CONCURRENT_RUNS,
+    max_queue=_config.ASSISTANT_MAX_QUEUE,
+    max_queue_per_user=_config.ASSISTANT_MAX_QUEUE_PER_USER,
+)
@@ -0,0 +1,76 @@
+#answer_cache.py
+
+import datetime as _dt
+import hashlib
+import logging
+import re
+
+import cache as _cache, config as _config, database as _database, services as _services
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+
+# normalized prompt hash -> answer
+_answers = _cache.TTLCache(maxsize=_config.ANSWER_CACHE_SIZE, ttl=_config.ANSWER_CACHE_TTL)
+
+
+def normalize(prompt: str) -> str:
+    """Lowercase and drop punctuation, so "How to plant crops?" matches "how to plant crops"."""
+    return " ".join(_WORD.findall(prompt.lower()))
+
+
+def prompt_key(prompt: str) -> str:
+    return hashlib.sha256(normalize(prompt).encode()).hexdigest()
+
+
+def is_eligible(prompt: str, username: str, use_cache: bool = True) -> bool:
+    """Whether this prompt may be answered from, and stored in, the cache.
+
+    Callers opt out per message, users opt out through ANSWER_CACHE_BYPASS_USERS,
+    and prompts that talk about the sender ("my farm") depend on the thread's
+    context, so they always go to the assistant.
+    """
+    if not _config.ANSWER_CACHE_ENABLED or not use_cache:
+        return False
+    if username in _config.ANSWER_CACHE_BYPASS_USERS:
+        return False
+    words = set(normalize(prompt).split())
+    return not words & set(_config.ANSWER_CACHE_PERSONAL_WORDS)
+
+
+def get(prompt: str):
+    return _answers.get(prompt_key(prompt))
+
+
+async def put(prompt: str, answer: str):
+    key = prompt_key(prompt)
+    _answers.set(key, answer)
+    if _config.ANSWER_CACHE_PERSIST:
+        expires_at = _dt.datetime.utcnow() + _dt.timedelta(seconds=_config.ANSWER_CACHE_TTL)
+        async with _database.AsyncSessionLocal() as db:
+            await _services.save_cached_answer_async(
+                db=db, key=key, prompt=prompt, answer=answer, expires_at=expires_at
+            )
+
+
+def load():
+    """Warm the cache from the cached_answers table and prune expired rows."""
+    if not (_config.ANSWER_CACHE_ENABLED and _config.ANSWER_CACHE_PERSIST):
+        return 0
+    now = _dt.datetime.utcnow()
+    db = _database.SessionLocal()
+    try:
+        _services.delete_expired_answers(db=db, now=now)
+        db_answers = _services.get_cached_answers(db=db, now=now, limit=_config.ANSWER_CACHE_SIZE)
+        # Oldest first, so the freshest answers end up most recently used.
+        for db_answer in reversed(db_answers):
+            ttl = (db_answer.expires_at - now).total_seconds()
+            _answers.set(db_answer.key, db_answer.answer, ttl=ttl)
+        return len(db_answers)
+    finally:
+        db.close()
+
+
+def stats():
+    return _answers.stats()
@@ -0,0 +1,260 @@
+#assistant.py
+
+import asyncio
+import itertools
+import logging
+import time
+
+import config as _config, metrics as _metrics, output_guard as _output_guard, output_pipeline as _output_pipeline
+
+logger = logging.getLogger(__name__)
+
+
+class AssistantBackend:
+    """What the chat endpoints need from an assistant: threads, messages and streamed runs."""
+
+    async def create_thread(self) -> str:
+        raise NotImplementedError
+
+    async def add_message(self, thread_id: str, content: str, role: str = "user"):
+        raise NotImplementedError
+
+    def stream_run(self, thread_id: str):
+        """Run the assistant on the thread, as an async iterator of raw text deltas."""
+        raise NotImplementedError
+
+    async def list_messages(self, thread_id: str, after: str = None):
+        """The thread's messages after message id `after`, oldest first, as {"id", "role", "content"} dicts."""
+        raise NotImplementedError
+
+    async def summarize(self, messages) -> str:
+        """A compact summary of list_messages() output, to seed a fresh thread with."""
+        raise NotImplementedError
+
+    async def cancel_run(self, thread_id: str):
+        """End the thread's run after its stream was closed early, and wait until it has.
+
+        Nothing to do for backends whose runs end with their stream.
+        """
+
+    def warmup(self):
+        """Load whatever the first request would otherwise wait for. Blocking, run in a thread."""
+
+    async def stream_reply(self, thread_id: str):
+        """stream_run through the OUTPUT_FILTERS pipeline and the output guard, without empty deltas.
+
+        If the reply ends before the run does (the output guard stopped it, or the
+        caller went away) the run is cancelled, so the thread takes new messages.
+        """
+        started = time.perf_counter()
+        finished = False
+
+        async def timed_run():
+            nonlocal finished
+            first = True
+            async for delta in self.stream_run(thread_id):
+                if first:
+                    _metrics.ASSISTANT_LATENCY.observe(time.perf_counter() - started, phase="first_token")
+                    first = False
+                yield delta
+            finished = True
+
+        try:
+            async for text in _output_guard.apply(_output_pipeline.build().apply(timed_run())):
+                yield text
+        finally:
+            if not finished:
+                await self.cancel_run(thread_id)
+        _metrics.ASSISTANT_LATENCY.observe(time.perf_counter() - started, phase="total")
+
+
+class OpenAIBackend(AssistantBackend):
+    """The OpenAI Assistants API, through AsyncOpenAI."""
+
+    # Polls of a cancelled run before the thread is given back anyway
+    CANCEL_POLLS = 60
+
+    def __init__(self, assistant_id: str, client=None):
+        self.assistant_id = assistant_id
+        self._client = client
+        # Run id of each thread's run that is still streaming
+        self._runs = {}
+
+    @property
+    def client(self):
+        # openai takes most of a second to import, it is loaded by warmup()
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI()
+        return self._client
+
+    def warmup(self):
+        from openai import AsyncAssistantEventHandler  # noqa: F401, used by stream_run
+        self.client
+
+    async def create_thread(self) -> str:
+        thread = await self.client.beta.threads.create()
+        return thread.id
+
+    async def add_message(self, thread_id: str, content: str, role: str = "user"):
+        await self.client.beta.threads.messages.create(
+            thread_id=thread_id,
+            role=role,
+            content=content
+        )
+
+    async def stream_run(self, thread_id: str):
+        from openai import AsyncAssistantEventHandler
+
+        class EventHandler(AsyncAssistantEventHandler):
+            """Collect the text deltas of a run as they arrive."""
+
+            def __init__(self):
+                super().__init__()
+                self.response = []
+
+            async def on_text_delta(self, delta, snapshot):
+                self.response.append(delta.value)
+
+        handler = EventHandler()
+        sent = 0
+        async with self.client.beta.threads.runs.stream(
+            thread_id=thread_id,
+            assistant_id=self.assistant_id,
+            event_handler=handler,
+        ) as stream:
+            async for event in stream:
+                if event.event == "thread.run.created":
+                    self._runs[thread_id] = event.data.id
+                for value in handler.response[sent:]:
+                    yield value
+                sent = len(handler.response)
+        self._runs.pop(thread_id, None)
+
+    async def cancel_run(self, thread_id: str):
+        # Closing the stream does not stop the run on OpenAI's side, and a thread
+        # with an active run refuses new messages
+        from openai import BadRequestError
+
+        run_id = self._runs.pop(thread_id, None)
+        if run_id is None:
+            return
+        try:
+            run = await self.client.beta.threads.runs.cancel(run_id, thread_id=thread_id)
+        except BadRequestError:
+            return  # it finished meanwhile
+        for _ in range(self.CANCEL_POLLS):
+            if run.status not in ("queued", "in_progress", "requires_action", "cancelling"):
+                return
+            await asyncio.sleep(0.5)
+            run = await self.client.beta.threads.runs.retrieve(run_id, thread_id=thread_id)
+        logger.warning("Run %s on %s still %s after cancelling", run_id, thread_id, run.status)
+
+    async def list_messages(self, thread_id: str, after: str = None):
+        params = {"after": after} if after else {}
+        messages = []
+        async for message in self.client.beta.threads.messages.list(
+            thread_id=thread_id, order="asc", limit=100, **params
+        ):
+            content = "".join(block.text.value for block in message.content if block.type == "text")
+            messages.append({"id": message.id, "role": message.role, "content": content})
+        return messages
+
+    async def summarize(self, messages) -> str:
+        # A plain completion: a run on the thread would hold it while the user waits
+        transcript = "\n\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        completion = await self.client.chat.completions.create(
+            model=_config.THREAD_SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": _config.THREAD_SUMMARY_PROMPT},
+                {"role": "user", "content": transcript},
+            ],
+        )
+        return completion.choices[0].message.content
+
+
+class FakeBackend(AssistantBackend):
+    """Deterministic local assistant for load tests and profiling, no network involved.
+
+    Each run waits `latency` seconds, then streams `reply_tokens` words at
+    `tokens_per_second`, with a citation marker after every
+    `citation_every` words (0 for none). `latency_per_message` more
+    seconds per message already on the thread mimic the cost of long
+    threads. Like OpenAI it refuses a second run, or a new message, on a
+    thread with an active run, and a run whose stream is closed early
+    stays active until cancel_run().
+    """
+
+    def __init__(self, latency: float = 0.5, tokens_per_second: float = 50.0,
+                 reply_tokens: int = 120, citation_every: int = 20, latency_per_message: float = 0.0):
+        self.latency = latency
+        self.latency_per_message = latency_per_message
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.citation_every = citation_every
+        self.threads = {}
+        self._active = set()
+        self._ids = itertools.count(1)
+
+    async def create_thread(self) -> str:
+        thread_id = f"thread_fake_{next(self._ids)}"
+        self.threads[thread_id] = []
+        return thread_id
+
+    async def add_message(self, thread_id: str, content: str, role: str = "user"):
+        if thread_id in self._active:
+            raise RuntimeError(f"Can't add messages to {thread_id} while a run is active.")
+        self.threads.setdefault(thread_id, []).append({"role": role, "content": content})
+
+    async def stream_run(self, thread_id: str):
+        if thread_id in self._active:
+            raise RuntimeError(f"Thread {thread_id} already has an active run.")
+        self._active.add(thread_id)
+        words = []
+        finished = False
+        try:
+            await asyncio.sleep(self.latency + self.latency_per_message * len(self.threads.get(thread_id, ())))
+            interval = 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+            for index in range(self.reply_tokens):
+                word = f"crop{index % 17}" + (" " if index + 1 < self.reply_tokens else ".")
+                words.append(word)
+                yield word
+                if self.citation_every and (index + 1) % self.citation_every == 0:
+                    yield f"【{index}:0†source】"
+                if interval:
+                    await asyncio.sleep(interval)
+            finished = True
+        finally:
+            if finished:
+                self._active.discard(thread_id)
+            self.threads.setdefault(thread_id, []).append({"role": "assistant", "content": "".join(words)})
+
+    async def cancel_run(self, thread_id: str):
+        self._active.discard(thread_id)
+
+    async def list_messages(self, thread_id: str, after: str = None):
+        start = int(after.rpartition("_")[2]) + 1 if after else 0
+        return [
+            {"id": f"msg_{index}", **message}
+            for index, message in enumerate(self.threads.get(thread_id, ())) if index >= start
+        ]
+
+    async def summarize(self, messages) -> str:
+        await asyncio.sleep(self.latency)
+        last = messages[-1]["content"][:200] if messages else ""
+        return f"Summary of {len(messages)} earlier messages, ending with: {last}"
+
+
+def get_backend() -> AssistantBackend:
+    """The backend selected by ASSISTANT_BACKEND."""
+    if _config.ASSISTANT_BACKEND == "fake":
+        return FakeBackend(
+            latency=_config.FAKE_ASSISTANT_LATENCY,
+            tokens_per_second=_config.FAKE_ASSISTANT_TOKENS_PER_SECOND,
+            reply_tokens=_config.FAKE_ASSISTANT_REPLY_TOKENS,
+            citation_every=_config.FAKE_ASSISTANT_CITATION_EVERY,
+            latency_per_message=_config.FAKE_ASSISTANT_LATENCY_PER_MESSAGE,
+        )
+    if _config.ASSISTANT_BACKEND == "openai":
+        return OpenAIBackend(_config.ASSISTANT_ID)
+    raise ValueError(f"Unknown ASSISTANT_BACKEND {_config.ASSISTANT_BACKEND!r}, expected openai or fake")
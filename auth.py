@@ -0,0 +1,107 @@
+#auth.py
+
+import asyncio
+import concurrent.futures as _futures
+import datetime as _dt
+import hashlib
+import time
+
+import jwt
+import sqlalchemy.ext.asyncio as _asyncio
+from passlib.hash import bcrypt
+
+import cache as _cache, config as _config, services as _services
+
+# sha256(token) -> username of tokens whose signature and expiry were checked
+_principals = _cache.TTLCache(maxsize=_config.AUTH_CACHE_SIZE, ttl=_config.AUTH_CACHE_TTL)
+
+
+# bcrypt costs ~250ms of CPU per call; it runs in this pool, never on the event loop.
+# The C implementation releases the GIL, so threads give real parallelism.
+_hash_executor = None
+# Hash of a throwaway password, at passlib's default cost, for unknown usernames
+_DUMMY_HASH = "$2b$12$j6cZRRFSzfBbVzW7Ih4TBuNyHvOl60shn1mpKPPKQdd/GzA/7dx0O"
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _executor():
+    # Created on first use, and again after shutdown(): an app can go through several lifespans
+    global _hash_executor
+    if _hash_executor is None:
+        _hash_executor = _futures.ThreadPoolExecutor(
+            max_workers=_config.AUTH_HASH_WORKERS, thread_name_prefix="bcrypt"
+        )
+    return _hash_executor
+
+
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor(), bcrypt.hash, password)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor(), bcrypt.verify, password, password_hash)
+
+
+async def authenticate_user(db: _asyncio.AsyncSession, username: str, password: str):
+    """Return the user if the password matches, else None.
+
+    The user is fetched once. Unknown usernames are checked against a dummy
+    hash so they take as long to refuse as a wrong password.
+    """
+    user = await _services.get_user_by_username_async(db=db, username=username)
+    if user is None:
+        await verify_password(password, _DUMMY_HASH)
+        return None
+    if not await verify_password(password, user.password_hash):
+        return None
+    return user
+
+
+def shutdown():
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=False)
+        _hash_executor = None
+
+
+def create_access_token(user):
+    expires = _dt.datetime.utcnow() + _dt.timedelta(minutes=_config.ACCESS_TOKEN_EXPIRE_MINUTES)
+    # Anyone holding the token can read its claims: nothing but who and until when
+    data = {
+        'username' : user.username,
+        'exp' : expires
+    }
+    return jwt.encode(data, _config.JWT_SECRET)
+
+
+def verify_token(token: str) -> str:
+    """Return the username of a valid token, skipping JWT verification for recently seen ones.
+
+    Cache entries never outlive the token's `exp` claim.
+    """
+    key = hashlib.sha256(token.encode()).hexdigest()
+    username = _principals.get(key)
+    if username is not None:
+        return username
+
+    try:
+        payload = jwt.decode(token, _config.JWT_SECRET, algorithms=['HS256'], options={"require": ["exp"]})
+    except jwt.PyJWTError as e:
+        raise InvalidToken(str(e)) from e
+    username = payload.get('username')
+    if not username:
+        raise InvalidToken("Token has no username")
+
+    ttl = min(_config.AUTH_CACHE_TTL, payload['exp'] - time.time())
+    if ttl > 0:
+        _principals.set(key, username, ttl=ttl)
+    return username
+
+
+def stats():
+    return _principals.stats()
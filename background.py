@@ -0,0 +1,23 @@
+#background.py
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Strong references, otherwise the loop may garbage collect running tasks.
+_tasks = set()
+
+
+def _done(task: asyncio.Task):
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background task failed", exc_info=task.exception())
+
+
+def spawn(coro):
+    """Run `coro` after the response has gone out, logging instead of raising on failure."""
+    task = asyncio.get_running_loop().create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_done)
+    return task
@@ -0,0 +1,321 @@
+#bench.py
+"""Load generator and latency benchmark for the chat API.
+
+Runs in-process against main.app by default, with the fake assistant
+backend and the local-only guard so no OpenAI or guardrails calls are made:
+
+    python bench.py --users 20 --concurrency 20 --duration 30
+    python bench.py --rate 50 --duration 60 --mix post_chat=1,get_chats=4,token=1
+    python bench.py --serialization --page-size 200
+
+--url drives a running server instead (it must already have the users,
+see --password). Results are printed and stored as JSON, tagged with the
+git commit, so runs can be compared across commits.
+"""
+
+import argparse
+import asyncio
+import collections
+import datetime as _dt
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+PROMPTS = [
+    "how to plant crops in uganda",
+    "When should I plant maize in Mbale?",
+    "what fertilizer is best for beans",
+    "How far apart should I plant cassava",
+    "how do I keep pests off my tomatoes",
+    "best coffee varieties for the Elgon region",
+    "who won the football match yesterday evening",
+]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.outcomes = collections.defaultdict(collections.Counter)
+        self.bytes = collections.Counter()
+
+    def record(self, endpoint, seconds, outcome, size=0):
+        self.latencies[endpoint].append(seconds)
+        self.outcomes[endpoint][outcome] += 1
+        self.bytes[endpoint] += size
+
+    def report(self, elapsed):
+        report = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            outcomes = self.outcomes[endpoint]
+            ok = sum(count for outcome, count in outcomes.items() if outcome[0] in "23")
+            report[endpoint] = {
+                "requests": len(values),
+                "throughput_rps": len(values) / elapsed if elapsed else 0.0,
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+                "max_ms": values[-1] * 1000,
+                "errors": len(values) - ok,
+                "outcomes": dict(outcomes),
+                "bytes_per_response": self.bytes[endpoint] / len(values),  # on the wire
+            }
+        return report
+
+
+class Bench:
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.recorder = Recorder()
+        self.tokens = {}
+        self.etags = {}
+        self.mix = []
+        for part in args.mix.split(","):
+            name, weight = part.split("=")
+            self.mix.append((name.strip(), float(weight)))
+
+    async def call(self, endpoint, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, timeout=self.args.timeout, **kwargs)
+            # Bytes on the wire, i.e. before decompression
+            outcome, size = str(response.status_code), response.num_bytes_downloaded
+        except Exception as e:
+            response, outcome, size = None, type(e).__name__, 0
+        self.recorder.record(endpoint, time.perf_counter() - started, outcome, size)
+        return response
+
+    async def login(self, username):
+        response = await self.call("token", "POST", "/api/token",
+                                   data={"username": username, "password": self.args.password})
+        if response is not None and response.status_code == 200:
+            self.tokens[username] = response.json()["access_token"]
+
+    async def request(self, rng):
+        username = rng.choice(list(self.tokens))
+        headers = {"Authorization": f"Bearer {self.tokens[username]}"}
+        endpoint = rng.choices([name for name, _ in self.mix], [weight for _, weight in self.mix])[0]
+        if endpoint == "token":
+            await self.login(username)
+        elif endpoint == "get_chats":
+            await self.call(endpoint, "GET", "/chats", params={"limit": self.args.page_size}, headers=headers)
+        elif endpoint == "get_chats_conditional":
+            # A client revalidating its copy of its latest history page
+            if username in self.etags:
+                headers["If-None-Match"] = self.etags[username]
+            response = await self.call(endpoint, "GET", "/chats", params={"limit": self.args.page_size},
+                                       headers=headers)
+            if response is not None and response.status_code == 200:
+                self.etags[username] = response.headers.get("etag")
+        elif endpoint == "post_chat":
+            await self.call(endpoint, "POST", "/chats", headers=headers,
+                            json={"sender": username, "content": rng.choice(PROMPTS)})
+        elif endpoint == "post_chat_stream":
+            await self.call(endpoint, "POST", "/chats/stream", headers=headers,
+                            json={"sender": username, "content": rng.choice(PROMPTS)})
+        else:
+            raise ValueError(f"Unknown endpoint {endpoint!r} in --mix")
+
+    async def run_closed(self, deadline):
+        """--concurrency workers, each sending its next request when the last one returns."""
+        async def worker(seed):
+            rng = random.Random(seed)
+            while time.perf_counter() < deadline:
+                await self.request(rng)
+        await asyncio.gather(*(worker(seed) for seed in range(self.args.concurrency)))
+
+    async def run_open(self, deadline):
+        """Requests started at --rate per second regardless of how fast they finish."""
+        rng = random.Random(0)
+        interval = 1.0 / self.args.rate
+        tasks = []
+        next_start = time.perf_counter()
+        while next_start < deadline:
+            tasks.append(asyncio.create_task(self.request(rng)))
+            next_start += interval
+            await asyncio.sleep(max(0.0, next_start - time.perf_counter()))
+        await asyncio.gather(*tasks)
+
+    async def run(self, usernames):
+        await asyncio.gather(*(self.login(username) for username in usernames))
+        if not self.tokens:
+            raise SystemExit("No user could log in, nothing to benchmark")
+
+        started = time.perf_counter()
+        deadline = started + self.args.duration
+        if self.args.rate:
+            await self.run_open(deadline)
+        else:
+            await self.run_closed(deadline)
+        return self.recorder.report(time.perf_counter() - started)
+
+
+def create_users(usernames, password):
+    """Insert benchmark users directly, hashing the shared password once."""
+    from passlib.hash import bcrypt
+    import database as _database, schemas as _schemas, services as _services
+
+    _services.create_database()
+    password_hash = bcrypt.hash(password)
+    db = _database.SessionLocal()
+    try:
+        existing = _services.get_existing_usernames(db=db, usernames=usernames)
+        for username in usernames:
+            if username not in existing:
+                user = _schemas.UserCreate(username=username, password=password)
+                _services.create_user(db=db, user=user, password_hash=password_hash, commit=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def serialization_benchmark(page_size, repeat=200):
+    """Time and size of one GET /chats page: the former pydantic + stdlib json path against
+    http_response, plain and compressed."""
+    import gzip
+    from fastapi.encoders import jsonable_encoder
+    import http_response as _http_response, main as _main, models as _models
+
+    now = _dt.datetime.utcnow()
+    rng = random.Random(0)
+    words = " ".join(PROMPTS).split()
+    db_messages = [
+        _models.ChatMessage(
+            id=index, message_id=str(uuid.UUID(int=rng.getrandbits(128))), username=f"farmer{index % 7}",
+            sender=f"farmer{index % 7}", timestamp=now, thread_id="thread_T7ixBYxREpbtGy1HCQyGdCc6",
+            content=" ".join(rng.choice(words) for _ in range(60)),
+        )
+        for index in range(page_size)
+    ]
+
+    def pydantic_json():
+        messages = [_main.ChatMessage(messageId=m.message_id, sender=m.sender, content=m.content,
+                                      timestamp=m.timestamp, thread_id=m.thread_id) for m in db_messages]
+        return json.dumps(jsonable_encoder(messages)).encode()
+
+    def fast_json():
+        return _http_response.dumps([_http_response.message_dict(m) for m in db_messages])
+
+    def timed(fn):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            body = fn()
+        return (time.perf_counter() - started) / repeat * 1000, body
+
+    report = {}
+    for name, fn in (("pydantic+json", pydantic_json), ("http_response.dumps", fast_json)):
+        ms, body = timed(fn)
+        report[name] = {"ms_per_page": ms, "bytes": len(body)}
+    ms, compressed = timed(lambda: gzip.compress(fast_json(), compresslevel=6))
+    report["dumps+gzip"] = {"ms_per_page": ms, "bytes": len(compressed)}
+    if _http_response.brotli is not None:
+        ms, compressed = timed(lambda: _http_response.brotli.compress(fast_json(), quality=5))
+        report["dumps+brotli"] = {"ms_per_page": ms, "bytes": len(compressed)}
+    return report
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+async def main_async(args):
+    import httpx
+
+    usernames = [f"bench{index}" for index in range(args.users)]
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url)
+    else:
+        create_users(usernames, args.password)
+        import main as _main
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=_main.app), base_url="http://bench")
+    async with client:
+        return await Bench(client, args).run(usernames)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--password", default="bench-password")
+    parser.add_argument("--concurrency", type=int, default=10, help="closed-loop workers")
+    parser.add_argument("--rate", type=float, default=0, help="open-loop requests per second, overrides --concurrency")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--mix", default="post_chat=1,get_chats=2,token=1",
+                        help="endpoint weights: post_chat, post_chat_stream, get_chats, get_chats_conditional, token")
+    parser.add_argument("--page-size", type=int, default=50, help="limit of GET /chats")
+    parser.add_argument("--serialization", action="store_true",
+                        help="only compare chat history encodings: time and bytes per page")
+    parser.add_argument("--fake-latency", type=float, default=0.5, help="fake assistant time to first token")
+    parser.add_argument("--fake-tokens-per-second", type=float, default=200)
+    parser.add_argument("--output", help="result file, defaults to bench_results/<time>-<commit>.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = None
+    if not args.url:
+        # Configure the in-process app before config.py is first imported
+        workdir = tempfile.mkdtemp(prefix="bench-")
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        os.environ.setdefault("ASSISTANT_BACKEND", "fake")
+        os.environ.setdefault("GUARD_BACKEND", "local")
+        os.environ.setdefault("FAKE_ASSISTANT_LATENCY", str(args.fake_latency))
+        os.environ.setdefault("FAKE_ASSISTANT_TOKENS_PER_SECOND", str(args.fake_tokens_per_second))
+
+    if args.serialization:
+        report = serialization_benchmark(args.page_size)
+    else:
+        report = asyncio.run(main_async(args))
+    result = {
+        "commit": git_commit(),
+        "date": _dt.datetime.utcnow().isoformat(),
+        "args": vars(args),
+        "environment": {
+            name: os.environ.get(name)
+            for name in ("DATABASE_URL", "ASSISTANT_BACKEND", "GUARD_BACKEND")
+        },
+        "endpoints": report,
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs("bench_results", exist_ok=True)
+        stamp = _dt.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        output = os.path.join("bench_results", f"{stamp}-{result['commit'] or 'nocommit'}.json")
+    with open(output, "w") as file:
+        json.dump(result, file, indent=2)
+
+    if args.serialization:
+        for name, stats in report.items():
+            print(f"{name:<28}{stats['ms_per_page']:>8.3f} ms/page{stats['bytes']:>9} bytes")
+        print(f"results written to {output}")
+        return
+
+    print(f"{'endpoint':<18}{'reqs':>7}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for endpoint, stats in report.items():
+        print(f"{endpoint:<18}{stats['requests']:>7}{stats['throughput_rps']:>9.1f}{stats['p50_ms']:>10.1f}"
+              f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['errors']:>8}  {stats['outcomes']}")
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+#config.py
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _get_bool(name: str, default: str):
+    return os.getenv(name, default).lower() == "true"
+
+
+def _get_list(name: str, default: str):
+    return [value.strip() for value in os.getenv(name, default).split(",") if value.strip()]
+
+
+# Database
+# Any SQLAlchemy URL; the async engine derives its driver from it
+# (sqlite -> aiosqlite, postgresql -> asyncpg) unless ASYNC_DATABASE_URL is set.
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database.db")
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", "")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_ECHO = _get_bool("DB_ECHO", "false")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# NORMAL is durable in WAL mode except for the last commits on power loss
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "20000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Guardrails
+# "guardrails" runs the hub validators; "local" only the local topic classifier,
+# for benchmarks and machines without the guardrails models
+GUARD_BACKEND = os.getenv("GUARD_BACKEND", "guardrails")
+GUARD_VALID_TOPICS = _get_list(
+    "GUARD_VALID_TOPICS", "uganda,farm,planting,crops,plant,buyanga,mbale,namutumbas"
+)
+GUARD_NSFW_THRESHOLD = float(os.getenv("GUARD_NSFW_THRESHOLD", "0.8"))
+# Local keyword/bag-of-words tier in front of the LLM topic validator
+GUARD_TOPIC_PREFILTER = _get_bool("GUARD_TOPIC_PREFILTER", "true")
+# Topic or related words, and the share of the message they make up, needed to
+# accept locally; a message with an off-topic word is never accepted locally
+GUARD_TOPIC_ACCEPT_MIN_WORDS = int(os.getenv("GUARD_TOPIC_ACCEPT_MIN_WORDS", "2"))
+GUARD_TOPIC_ACCEPT_SCORE = float(os.getenv("GUARD_TOPIC_ACCEPT_SCORE", "0.2"))
+# Content words needed before a message with an off-topic word and no farming word
+# is rejected locally (see OFF_TOPIC_TERMS in topic_filter.py)
+GUARD_TOPIC_REJECT_MIN_WORDS = int(os.getenv("GUARD_TOPIC_REJECT_MIN_WORDS", "4"))
+# Cached guard verdicts per normalized message; a size of 0 disables the cache
+GUARD_CACHE_SIZE = int(os.getenv("GUARD_CACHE_SIZE", "2048"))
+GUARD_CACHE_TTL = float(os.getenv("GUARD_CACHE_TTL", "3600"))
+# Worker threads running validators; torch releases the GIL during inference.
+GUARD_POOL_SIZE = int(os.getenv("GUARD_POOL_SIZE", "2"))
+# Validations allowed to wait for a worker before new ones are refused.
+GUARD_QUEUE_DEPTH = int(os.getenv("GUARD_QUEUE_DEPTH", "32"))
+# Worker threads checking reply sentences, apart from the ones checking prompts
+GUARD_OUTPUT_POOL_SIZE = int(os.getenv("GUARD_OUTPUT_POOL_SIZE", "1"))
+
+# Assistant
+# "openai" for the Assistants API, "fake" for the offline FakeBackend in assistant.py
+ASSISTANT_BACKEND = os.getenv("ASSISTANT_BACKEND", "openai")
+ASSISTANT_ID = os.getenv("ASSISTANT_ID", "asst_gJkvVb6RSZj8BofmghLOnWVi")
+FAKE_ASSISTANT_LATENCY = float(os.getenv("FAKE_ASSISTANT_LATENCY", "0.5"))
+FAKE_ASSISTANT_TOKENS_PER_SECOND = float(os.getenv("FAKE_ASSISTANT_TOKENS_PER_SECOND", "50"))
+FAKE_ASSISTANT_REPLY_TOKENS = int(os.getenv("FAKE_ASSISTANT_REPLY_TOKENS", "120"))
+FAKE_ASSISTANT_CITATION_EVERY = int(os.getenv("FAKE_ASSISTANT_CITATION_EVERY", "20"))
+FAKE_ASSISTANT_LATENCY_PER_MESSAGE = float(os.getenv("FAKE_ASSISTANT_LATENCY_PER_MESSAGE", "0"))
+# Streaming filters applied to every reply, in order (see output_pipeline.py)
+OUTPUT_FILTERS = _get_list("OUTPUT_FILTERS", "citations,whitespace")
+# NSFW check of replies, sentence by sentence: "redact" replaces a failing sentence
+# with OUTPUT_GUARD_NOTICE, "stop" also ends the reply there, "off" skips the check
+OUTPUT_GUARD = os.getenv("OUTPUT_GUARD", "redact")
+OUTPUT_GUARD_NOTICE = os.getenv("OUTPUT_GUARD_NOTICE", "[removed]")
+# Text without a sentence end is checked in pieces of at most this many characters
+OUTPUT_GUARD_MAX_CHARS = int(os.getenv("OUTPUT_GUARD_MAX_CHARS", "400"))
+
+# Thread compaction
+# A thread past either limit (0 for none) is replaced, in the background, by a new one
+# seeded with a summary of it; token counts are estimated at 4 characters per token
+THREAD_MAX_MESSAGES = int(os.getenv("THREAD_MAX_MESSAGES", "100"))
+THREAD_MAX_TOKENS = int(os.getenv("THREAD_MAX_TOKENS", "32000"))
+THREAD_SUMMARY_MODEL = os.getenv("THREAD_SUMMARY_MODEL", "gpt-4o-mini")
+THREAD_SUMMARY_PROMPT = os.getenv(
+    "THREAD_SUMMARY_PROMPT",
+    "Summarize this conversation between a farmer and an agricultural assistant in at most 200 words. "
+    "Keep the farmer's crops, location, farm details and open questions, and the advice already given.",
+)
+# Other worker processes see a user's new thread within this many seconds
+THREAD_CACHE_TTL = float(os.getenv("THREAD_CACHE_TTL", "30"))
+
+# Shared state
+# "database" keeps chat history, user threads and thread leases in the database, safe
+# with several worker processes; "memory" keeps them in-process (tests, single worker)
+SHARED_STATE = os.getenv("SHARED_STATE", "database")
+# A worker that dies mid-run blocks its thread for at most this long
+THREAD_LEASE_TTL = float(os.getenv("THREAD_LEASE_TTL", "300"))
+
+# Assistant admission control
+# Limits are per worker process
+ASSISTANT_MAX_CONCURRENT_RUNS = int(os.getenv("ASSISTANT_MAX_CONCURRENT_RUNS", "8"))
+# Runs allowed to wait for a slot, in total and per user, before requests get 429
+ASSISTANT_MAX_QUEUE = int(os.getenv("ASSISTANT_MAX_QUEUE", "64"))
+ASSISTANT_MAX_QUEUE_PER_USER = int(os.getenv("ASSISTANT_MAX_QUEUE_PER_USER", "4"))
+
+# Answer cache for repeated prompts
+ANSWER_CACHE_ENABLED = _get_bool("ANSWER_CACHE_ENABLED", "false")
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+# Keep answers in the cached_answers table so a restart does not start cold
+ANSWER_CACHE_PERSIST = _get_bool("ANSWER_CACHE_PERSIST", "true")
+# On a hit, still record the question and cached answer on the user's thread
+ANSWER_CACHE_APPEND_TO_THREAD = _get_bool("ANSWER_CACHE_APPEND_TO_THREAD", "true")
+ANSWER_CACHE_BYPASS_USERS = _get_list("ANSWER_CACHE_BYPASS_USERS", "")
+# Prompts containing any of these words need the user's own context
+ANSWER_CACHE_PERSONAL_WORDS = _get_list("ANSWER_CACHE_PERSONAL_WORDS", "my,mine,our,ours")
+
+# Request profiling
+# Share of requests profiled without asking; admins can also send `X-Profile: 1`
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+# Only the newest profiles are kept
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+
+# Chat history responses
+# Bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+# Used when the brotli package is installed and the client accepts br
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+# WebSocket chat channel
+# The server pings this often; connections silent for WS_HEARTBEAT_TIMEOUT are closed
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20"))
+WS_HEARTBEAT_TIMEOUT = float(os.getenv("WS_HEARTBEAT_TIMEOUT", "60"))
+# Frames queued per connection; replies wait while it is full
+WS_SEND_BUFFER = int(os.getenv("WS_SEND_BUFFER", "256"))
+# A client that lets the buffer stay full this long is disconnected
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "30"))
+
+# Authentication
+JWT_SECRET = os.getenv("JWT_SECRET", "myjwtsecret")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "1440"))
+# Threads hashing and checking passwords; bounds bcrypt CPU during login bursts
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+# Usernames allowed to call the /admin endpoints
+ADMIN_USERS = _get_list("ADMIN_USERS", "")
+# Legacy registration allowlist, imported into the verified_users table at startup
+VERIFIED_USERS = _get_list("VERIFIED_USERS", "")
+# Verified tokens, keyed on the token hash; entries never outlive the token's exp
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "4096"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+# Users looked up by username; bounds staleness across processes
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
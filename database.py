@@ -1,15 +1,103 @@
 #database.py
 
+import time
+
 import sqlalchemy as _sql
+import sqlalchemy.ext.asyncio as _asyncio
 import sqlalchemy.ext.declarative as _declarative
 import sqlalchemy.orm as _orm
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./database.db"
+import config as _config, metrics as _metrics
 
-engine = _sql.create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+SQLALCHEMY_DATABASE_URL = _config.DATABASE_URL
+
+
+def _async_url(url: str) -> str:
+    """The async driver flavour of a sync database URL."""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:") or url.startswith("postgres:"):
+        return "postgresql+asyncpg:" + url.split(":", 1)[1]
+    return url
+
+
+ASYNC_DATABASE_URL = _config.ASYNC_DATABASE_URL or _async_url(SQLALCHEMY_DATABASE_URL)
+
+_is_sqlite = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+_is_memory = _is_sqlite and ":memory:" in SQLALCHEMY_DATABASE_URL
+
+
+def _engine_options():
+    options = {"echo": _config.DB_ECHO}
+    if _is_sqlite:
+        options["connect_args"] = {"check_same_thread": False}
+    if not _is_memory:
+        # In-memory SQLite uses a single shared connection, there is nothing to size
+        options.update(
+            pool_size=_config.DB_POOL_SIZE,
+            max_overflow=_config.DB_MAX_OVERFLOW,
+            pool_timeout=_config.DB_POOL_TIMEOUT,
+            pool_pre_ping=not _is_sqlite,
+        )
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Per-connection tuning: WAL lets readers run alongside a writer."""
+    cursor = dbapi_connection.cursor()
+    if not _is_memory:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={_config.SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA synchronous={_config.SQLITE_SYNCHRONOUS}")
+    # Negative cache_size is in KiB
+    cursor.execute(f"PRAGMA cache_size=-{_config.SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={_config.SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "PRAGMA", "BEGIN", "COMMIT", "ROLLBACK"}
+
+
+def _timed(engine_name: str):
+    """Cursor event listeners feeding db_query_duration_seconds."""
+    def before(conn, cursor, statement, parameters, context, executemany):
+        # Kept on the execution context, so a failing statement leaves nothing behind
+        context._query_started = time.perf_counter()
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_started
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+        if operation not in _OPERATIONS:
+            operation = "OTHER"
+        _metrics.DB_LATENCY.observe(elapsed, engine=engine_name, operation=operation)
+
+    return before, after
+
+
+def _instrument(sync_engine, engine_name: str):
+    before, after = _timed(engine_name)
+    _sql.event.listen(sync_engine, "before_cursor_execute", before)
+    _sql.event.listen(sync_engine, "after_cursor_execute", after)
+
+
+engine = _sql.create_engine(SQLALCHEMY_DATABASE_URL, **_engine_options())
+
+async_engine = _asyncio.create_async_engine(ASYNC_DATABASE_URL, **_engine_options())
+
+if _is_sqlite:
+    _sql.event.listen(engine, "connect", _set_sqlite_pragmas)
+    _sql.event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+_instrument(engine, "sync")
+_instrument(async_engine.sync_engine, "async")
 
 SessionLocal = _orm.sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = _declarative.declarative_base()
\ No newline at end of file
+# expire_on_commit=False: attributes must stay readable without lazy IO after commit
+AsyncSessionLocal = _orm.sessionmaker(
+    bind=async_engine, class_=_asyncio.AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+Base = _declarative.declarative_base()
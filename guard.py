@@ -0,0 +1,256 @@
+#guard.py
+
+import asyncio
+import concurrent.futures as _futures
+import hashlib
+import logging
+import threading
+
+import cache as _cache, config as _config, topic_filter as _topic_filter
+
+logger = logging.getLogger(__name__)
+
+WARMUP_TEXT = "how to plant crops in uganda"
+
+_guard = None
+_nsfw = None
+_topic_guard = None
+_classifier = None
+_rejections = ()
+_built_fingerprint = None
+_executor = None
+_pending = 0
+# Reply sentences are checked on their own workers, so prompts never queue behind them
+_output_executor = None
+_output_pending = 0
+_topic_llm = {"pass": 0, "fail": 0}
+_stats_lock = threading.Lock()
+# Startup runs in a background warmup and in the first validations; build only once
+_startup_lock = threading.Lock()
+# normalized message + config fingerprint -> (passed, error text)
+_verdicts = _cache.TTLCache(maxsize=_config.GUARD_CACHE_SIZE, ttl=_config.GUARD_CACHE_TTL)
+
+
+class GuardBusy(Exception):
+    """Raised when more validations are waiting than GUARD_QUEUE_DEPTH allows."""
+
+
+class OffTopic(Exception):
+    """Raised when the local topic classifier rejects a message outright."""
+
+
+class GuardRejected(Exception):
+    """Raised for a message whose failing verdict was served from the cache."""
+
+
+def config_fingerprint():
+    """Digest of every setting that can change a verdict."""
+    settings = (
+        _config.GUARD_BACKEND,
+        _config.GUARD_VALID_TOPICS,
+        _config.GUARD_NSFW_THRESHOLD,
+        _config.GUARD_TOPIC_PREFILTER,
+        _config.GUARD_TOPIC_ACCEPT_SCORE,
+        _config.GUARD_TOPIC_ACCEPT_MIN_WORDS,
+        _config.GUARD_TOPIC_REJECT_MIN_WORDS,
+    )
+    return hashlib.sha256(repr(settings).encode()).hexdigest()
+
+
+def cache_key(text: str, fingerprint: str):
+    normalized = " ".join(text.lower().split())
+    return hashlib.sha256(f"{fingerprint}\0{normalized}".encode()).hexdigest()
+
+
+def build_guard():
+    """Build the NSFW and topic guards. Imports guardrails lazily."""
+    global _rejections
+    from guardrails import Guard
+    from guardrails.errors import ValidationError
+    from guardrails.hub import NSFWText, RestrictToTopic
+
+    # Only real verdicts are cached, never transport errors from the topic LLM
+    _rejections = (ValidationError, OffTopic)
+
+    nsfw = NSFWText(
+        threshold=_config.GUARD_NSFW_THRESHOLD, validation_method="sentence", on_fail="exception"
+    )
+    topic_guard = Guard().use(
+        RestrictToTopic(
+            valid_topics=_config.GUARD_VALID_TOPICS,
+            disable_classifier=True,
+            disable_llm=False,
+            on_fail="exception",
+        )
+    )
+    return Guard().use(nsfw), nsfw, topic_guard
+
+
+def build_classifier():
+    if not _config.GUARD_TOPIC_PREFILTER:
+        return None
+    return _topic_filter.TopicClassifier(
+        _config.GUARD_VALID_TOPICS,
+        accept_score=_config.GUARD_TOPIC_ACCEPT_SCORE,
+        reject_min_words=_config.GUARD_TOPIC_REJECT_MIN_WORDS,
+        accept_min_words=_config.GUARD_TOPIC_ACCEPT_MIN_WORDS,
+    )
+
+
+def _validate(text: str):
+    """NSFW check, then the local topic tier, then the LLM topic tier if still unsure."""
+    if _guard is not None:
+        _guard.validate(text)
+
+    verdict = _classifier.classify(text) if _classifier else _topic_filter.AMBIGUOUS
+    if verdict == _topic_filter.REJECT:
+        raise OffTopic("Validation failed for field with errors: No valid topic was found.")
+    if verdict == _topic_filter.ACCEPT or _topic_guard is None:
+        return
+
+    try:
+        _topic_guard.validate(text)
+    except Exception:
+        with _stats_lock:
+            _topic_llm["fail"] += 1
+        raise
+    with _stats_lock:
+        _topic_llm["pass"] += 1
+
+
+def stats():
+    """Hit counts of each topic tier, for tuning the classifier thresholds."""
+    return {
+        "topic_prefilter": _classifier.stats() if _classifier else None,
+        "topic_llm": dict(_topic_llm),  # outcomes of messages the local tier passed on
+        "verdict_cache": _verdicts.stats(),
+    }
+
+
+def startup():
+    """Build the validators once and warm the NSFW model.
+
+    Rebuilds them, and drops cached verdicts, if the guard settings changed.
+    """
+    with _startup_lock:
+        _startup()
+
+
+def _startup():
+    global _guard, _nsfw, _topic_guard, _classifier, _built_fingerprint, _executor, _output_executor, _rejections
+    if _executor is None:
+        _executor = _futures.ThreadPoolExecutor(
+            max_workers=_config.GUARD_POOL_SIZE, thread_name_prefix="guard"
+        )
+    if _output_executor is None:
+        _output_executor = _futures.ThreadPoolExecutor(
+            max_workers=_config.GUARD_OUTPUT_POOL_SIZE, thread_name_prefix="guard-output"
+        )
+    fingerprint = config_fingerprint()
+    if fingerprint != _built_fingerprint:
+        _verdicts.clear()
+        _classifier = build_classifier()
+        if _config.GUARD_BACKEND == "local":
+            # No guardrails at all: only the local topic tier, ambiguous messages pass
+            _guard = _nsfw = _topic_guard = None
+            _rejections = (OffTopic,)
+        else:
+            _guard, _nsfw, _topic_guard = build_guard()
+            try:
+                # Only the NSFW model is warmed: the topic validator would spend an LLM call.
+                _nsfw.validate(WARMUP_TEXT, {})
+            except Exception:
+                logger.exception("NSFW model warmup failed")
+        # Set last: validate() keeps calling startup(), and waiting on the lock, until this is done
+        _built_fingerprint = fingerprint
+
+
+def shutdown():
+    global _executor, _output_executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+    if _output_executor is not None:
+        _output_executor.shutdown(wait=False)
+        _output_executor = None
+
+
+def queue_depth():
+    """Validations currently running or waiting for a worker."""
+    return _pending
+
+
+def output_queue_depth():
+    """Reply sentences currently being checked or waiting for an output worker."""
+    return _output_pending
+
+
+def output_checks_enabled():
+    """Whether validate_output has a validator to run; GUARD_BACKEND=local has none."""
+    return _config.GUARD_BACKEND != "local"
+
+
+async def validate_output(text: str):
+    """NSFW-check assistant output on the output pool; the topic tiers only apply to user input.
+
+    Verdicts are cached like those of validate(). Output checks are never
+    refused with GuardBusy: the reply is already being generated.
+    """
+    global _output_pending
+    fingerprint = config_fingerprint()
+    if fingerprint != _built_fingerprint:
+        await asyncio.to_thread(startup)
+    if _guard is None:
+        return
+
+    key = cache_key("output\0" + text, fingerprint)
+    verdict = _verdicts.get(key)
+    if verdict is not None:
+        passed, error = verdict
+        if passed:
+            return
+        raise GuardRejected(error)
+
+    _output_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_output_executor, _guard.validate, text)
+    except _rejections as e:
+        _verdicts.set(key, (False, str(e)))
+        raise
+    finally:
+        _output_pending -= 1
+    _verdicts.set(key, (True, None))
+
+
+async def validate(text: str):
+    """Validate `text` on the guard pool. Validator failures propagate as exceptions.
+
+    Verdicts, passing or failing, are cached per normalized message.
+    """
+    global _pending
+    fingerprint = config_fingerprint()
+    if fingerprint != _built_fingerprint:
+        await asyncio.to_thread(startup)
+
+    key = cache_key(text, fingerprint)
+    verdict = _verdicts.get(key)
+    if verdict is not None:
+        passed, error = verdict
+        if passed:
+            return
+        raise GuardRejected(error)
+
+    if _pending >= _config.GUARD_POOL_SIZE + _config.GUARD_QUEUE_DEPTH:
+        raise GuardBusy("Too many messages are being checked, please try again shortly.")
+
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_executor, _validate, text)
+    except _rejections as e:
+        _verdicts.set(key, (False, str(e)))
+        raise
+    finally:
+        _pending -= 1
+    _verdicts.set(key, (True, None))
@@ -0,0 +1,120 @@
+#http_response.py
+
+import datetime as _dt
+import email.utils
+import gzip
+import hashlib
+import json
+
+from fastapi import Response
+
+import config as _config
+
+try:
+    import orjson
+except ImportError:  # stdlib json is slower but produces the same documents
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+
+def _default(value):
+    if isinstance(value, (_dt.datetime, _dt.date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> bytes:
+    """Compact JSON, through orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def message_dict(db_message) -> dict:
+    """A stored chat message in the ChatMessage response shape, without a pydantic round trip."""
+    return {
+        "messageId": db_message.message_id,
+        "sender": db_message.sender,
+        "content": db_message.content,
+        "timestamp": db_message.timestamp,
+        "thread_id": db_message.thread_id,
+    }
+
+
+def etag(*parts) -> str:
+    """A weak validator: the gzip, brotli and identity bodies share it."""
+    digest = hashlib.sha256("\0".join(str(part) for part in parts).encode()).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+
+def _http_date(value: _dt.datetime) -> str:
+    # Stored timestamps are naive UTC
+    return email.utils.format_datetime(value.replace(tzinfo=_dt.timezone.utc, microsecond=0), usegmt=True)
+
+
+def _not_modified(request, tag: str, last_modified: _dt.datetime) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match wins over If-Modified-Since
+        tags = {value.strip().removeprefix("W/") for value in if_none_match.split(",")}
+        return "*" in tags or tag.removeprefix("W/") in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=_dt.timezone.utc)
+        return last_modified.replace(tzinfo=_dt.timezone.utc, microsecond=0) <= since
+    return False
+
+
+def _accepts(request, coding: str) -> bool:
+    for value in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = value.strip().partition(";")
+        if name.strip().lower() == coding:
+            quality = params.strip().removeprefix("q=")
+            try:
+                return not params or float(quality) > 0
+            except ValueError:
+                return True
+    return False
+
+
+def compress(request, body: bytes):
+    """(body, content-encoding) for the best encoding the client accepts, if worth it."""
+    if len(body) < _config.COMPRESS_MIN_BYTES:
+        return body, None
+    if brotli is not None and _accepts(request, "br"):
+        return brotli.compress(body, quality=_config.BROTLI_QUALITY), "br"
+    if _accepts(request, "gzip"):
+        return gzip.compress(body, compresslevel=_config.GZIP_LEVEL), "gzip"
+    return body, None
+
+
+def json_response(request, obj, tag: str, last_modified: _dt.datetime = None,
+                  cache_control: str = "private, no-cache", headers: dict = None) -> Response:
+    """A compressed JSON response carrying ETag/Last-Modified, or a bodiless 304 when the
+    client's copy is current.
+
+    `tag` must change whenever `obj` would; it is checked before `obj` is
+    serialized, so a 304 costs no encoding at all.
+    """
+    headers = dict(headers or {})
+    headers["ETag"] = tag
+    headers["Cache-Control"] = cache_control
+    headers["Vary"] = "Accept-Encoding"
+    if last_modified is not None:
+        headers["Last-Modified"] = _http_date(last_modified)
+    if _not_modified(request, tag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    body, encoding = compress(request, dumps(obj))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,64 @@
+#lifecycle.py
+
+import asyncio
+import contextlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+# uvicorn configures this one, so the startup breakdown reaches journalctl
+_uvicorn_logger = logging.getLogger("uvicorn.error")
+
+# Startup step -> seconds, in the order the steps ran
+_timings = {}
+_ready = False
+_error = None
+
+
+@contextlib.contextmanager
+def step(name: str):
+    """Time one startup step for the breakdown logged once the app is ready."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _timings[name] = time.perf_counter() - started
+
+
+def record(name: str, seconds: float):
+    _timings[name] = seconds
+
+
+async def warmup(steps):
+    """Run (name, function) steps in order, then mark the app ready.
+
+    Blocking functions run in a worker thread, coroutine functions on the loop.
+    A failing step leaves the app unready; /readyz reports the error.
+    """
+    global _ready, _error
+    try:
+        for name, fn in steps:
+            with step(name):
+                if asyncio.iscoroutinefunction(fn):
+                    await fn()
+                else:
+                    await asyncio.to_thread(fn)
+    except Exception as e:
+        _error = f"{name}: {e}"
+        logger.exception("Startup step %s failed", name)
+        return
+    _ready = True
+    _uvicorn_logger.info("Ready in %.2fs (%s)", sum(_timings.values()),
+                         ", ".join(f"{name} {seconds:.2f}s" for name, seconds in _timings.items()))
+
+
+def is_ready() -> bool:
+    return _ready
+
+
+def status():
+    return {
+        "status": "ready" if _ready else ("failed" if _error else "starting"),
+        "error": _error,
+        "startup_seconds": {name: round(seconds, 3) for name, seconds in _timings.items()},
+    }
@@ -1,50 +1,80 @@
+import time
+_import_started = time.perf_counter()
+
 import json
+import asyncio
+import contextlib
+import logging
 from typing import List, Optional
-import os
-from openai import OpenAI, AssistantEventHandler
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, File, HTTPException, Query, Request, Response, UploadFile, WebSocket, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from datetime import datetime
 import uuid
-import jwt
-import re
-import sqlalchemy.orm as _orm
+import sqlalchemy.exc as _sql_exc
+import sqlalchemy.ext.asyncio as _asyncio
 from dotenv import load_dotenv
-import services as _services, schemas as _schemas
-from tortoise.models import Model
-from tortoise import fields
-from passlib.hash import bcrypt
-from tortoise.contrib.pydantic import pydantic_model_creator
-from guardrails import Guard
-from guardrails.hub import NSFWText
-from guardrails.hub import RestrictToTopic
-
+import services as _services, schemas as _schemas, thread_registry as _thread_registry, state as _state
+import run_scheduler as _run_scheduler, assistant as _assistant
+import admission as _admission, auth as _auth, provision as _provision, guard as _guard, answer_cache as _answer_cache, background as _background, config as _config
+import metrics as _metrics, profiling as _profiling, lifecycle as _lifecycle, http_response as _http_response
+import ws_connection as _ws_connection, thread_compaction as _thread_compaction
+
+
+logger = logging.getLogger(__name__)
+
+backend = _assistant.get_backend()
+
+
+def setup_database(attempts: int = 5):
+    """Create missing tables and import the legacy JSON/env data; needed before any request.
+
+    Every worker process runs this at once; one that loses a race on a table
+    or row the others created simply tries again, and then finds it present.
+    """
+    for attempt in range(attempts):
+        try:
+            _services.create_database()
+            _thread_registry.import_json_threads()
+            _provision.import_env_allowlist()
+            return
+        except (_sql_exc.OperationalError, _sql_exc.IntegrityError):
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.1 * (attempt + 1))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    _lifecycle.record("import", time.perf_counter() - _import_started)
+    with _lifecycle.step("database"):
+        await asyncio.to_thread(setup_database)
+    # The server accepts requests while the rest warms up; /readyz tells when it is done
+    _background.spawn(_lifecycle.warmup([
+        ("guard", _guard.startup),  # builds the validators and warms the NSFW model
+        ("answer_cache", _answer_cache.load),
+        ("assistant", backend.warmup),
+        ("db_pool", _services.warmup_async),
+    ]))
+    yield
+    _guard.shutdown()
+    _auth.shutdown()
 
-# Define a simple secret key for JWT encoding
-JWT_SECRET = 'myjwtsecret'
-client = OpenAI()
 
 # Initialize FastAPI
 app = FastAPI(
     title="UgandAPI Chat",
     description="This API facilitates communication for our chat-based mobile application hosted in Android Studio.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
+app.add_middleware(_profiling.ProfilingMiddleware)
+app.add_middleware(_metrics.MetricsMiddleware)
 
-_services.create_database()
-
-class User(Model):
-    id = fields.IntField(pk=True)
-    username = fields.CharField(50, unique=True)
-    password_hash = fields.CharField(128)
 
-    def verify_password(self, password):
-        return bcrypt.verify(password, self.password_hash)
-
-
-User_Pydantic = pydantic_model_creator(User, name='User')
-UserIn_Pydantic = pydantic_model_creator(User, name='UserIn', exclude_readonly=True)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
@@ -60,6 +90,7 @@ class NewChatMessage(BaseModel):
     sender: str
     content: str
     thread_id: Optional[str] = None  # Include thread_id in the request model
+    use_cache: bool = True  # Set to false to always get a fresh assistant run
 
 class UserCredentials(BaseModel):
     username: str
@@ -78,156 +109,360 @@ class UserResponse(BaseModel):
 class TokenResponse(BaseModel):
     token: str
 
-# In-memory storage for simplicity
-chats = []
-users = {}
-tokens = {}
+# Chat history and the user -> thread map live in the shared state (state.py), so any
+# number of worker processes can serve the same users
 
-def get_user_threads():
-    """Load user thread IDs from a JSON file."""
-    try:
-        with open("user_threads.json", "r") as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {}
-def save_user_threads(user_threads):
-    """Save user thread IDs to a JSON file."""
-    with open("user_threads.json", "w") as file:
-        json.dump(user_threads, file)
-
-def interact_with_assistant(prompt, username):
-    assistant = "asst_gJkvVb6RSZj8BofmghLOnWVi"
-    
-    user_threads = get_user_threads()
-    thread_id = user_threads.get(username)
-    
-    if not thread_id:
-        # If the user doesn't have a thread_id, create a new one
-        thread = client.beta.threads.create()
-        thread_id = thread.id
-        user_threads[username] = thread_id
-        save_user_threads(user_threads)
-    
-    
 
-    # Create a message before starting the stream
-    message = client.beta.threads.messages.create(
-        thread_id=thread_id,
-        role="user",
-        content=prompt
-    )
+async def get_thread_id(username):
+    """The user's thread id, creating the thread on their first message."""
+    with _metrics.STAGE_LATENCY.time(stage="thread"):
+        return await _thread_registry.get_or_create_thread(username, backend.create_thread)
 
-    class EventHandler(AssistantEventHandler):
-        def on_text_delta(self, delta, snapshot):
-            cleaned_value = re.sub(r"【\d+:\d+†.*?】", "", delta.value)
-            self.response.append(cleaned_value)
 
-    handler = EventHandler()
-    handler.response = []
+# Moves users off threads that grew too long, once their runs report the thread's size
+compactor = _thread_compaction.Compactor(backend, lambda thread_id: scheduler.lock(thread_id))
 
-    # Stream the response from the assistant
-    with client.beta.threads.runs.stream(
-        thread_id=thread_id,
-        assistant_id=assistant,
-        event_handler=handler,
-    ) as stream:
-        stream.until_done()
+# The shared thread lease keeps other worker processes off a thread during a run
+scheduler = _run_scheduler.RunScheduler(
+    backend.add_message, backend.stream_reply, lease=lambda thread_id: _state.store.thread_lease(thread_id),
+    on_run=compactor.record_run,
+)
 
-    return "".join(handler.response), thread_id
 
-# Authentication and Token Management
-async def authenticate_user(username: str, password: str, db: _orm.Session = Depends(_services.get_db)):
-    user = _services.get_user_by_username(db=db, username=username)
-    if not user or not _services.verify_password(db, username, password):
+def cache_hit_ratios():
+    return {
+        "guard_verdicts": _guard.stats()["verdict_cache"]["hit_ratio"],
+        "answers": _answer_cache.stats()["hit_ratio"],
+        "auth_tokens": _auth.stats()["hit_ratio"],
+        "users": _services.stats()["users"]["hit_ratio"],
+    }
+
+
+_metrics.Callback("assistant_runs_in_flight", "Assistant runs holding an admission slot.",
+                  lambda: _admission.controller.stats()["active"])
+_metrics.Callback("assistant_runs_queued", "Requests waiting for an admission slot.",
+                  lambda: _admission.controller.stats()["queued"])
+_metrics.Callback("assistant_admission_rejected_total", "Requests answered 429 by admission control.",
+                  lambda: _admission.controller.stats()["rejected"], kind="counter")
+_metrics.Callback("assistant_threads_running", "Threads with an assistant run in progress.",
+                  lambda: scheduler.stats()["active_threads"])
+_metrics.Callback("assistant_runs_total", "Assistant runs started.", lambda: scheduler.stats()["runs"], kind="counter")
+_metrics.Callback("assistant_coalesced_messages_total", "Messages that joined a run started for another message.",
+                  lambda: scheduler.stats()["coalesced_messages"], kind="counter")
+_metrics.Callback("guard_validations_pending", "Guard validations running or waiting for a worker.", _guard.queue_depth)
+_metrics.Callback("guard_output_checks_pending", "Reply sentences being checked or waiting for an output worker.",
+                  _guard.output_queue_depth)
+_metrics.Callback("websocket_connections", "Open WebSocket chat connections.", _ws_connection.open_connections)
+_metrics.Callback("cache_hit_ratio", "Hit ratio of the in-process caches.", cache_hit_ratios, labelname="cache")
+
+
+async def submit_prompt(prompt, username):
+    """Queue the prompt on the user's thread; returns the Batch answering it and the thread id."""
+    thread_id = await get_thread_id(username)
+    return scheduler.submit(thread_id, prompt), thread_id
+
+
+async def append_cached_exchange(prompt, answer, username):
+    """Record a question answered from the cache, and its answer, on the user's thread."""
+    thread_id = await get_thread_id(username)
+    async with scheduler.lock(thread_id):
+        await backend.add_message(thread_id, prompt)
+        await backend.add_message(thread_id, answer, role="assistant")
+
+
+def get_cached_answer(new_message, username):
+    """Return (content, thread_id) for a prompt answered from the cache, or None."""
+    if not _answer_cache.is_eligible(new_message.content, username, new_message.use_cache):
         return None
-    return user
+    answer = _answer_cache.get(new_message.content)
+    if answer is None:
+        return None
+    if _config.ANSWER_CACHE_APPEND_TO_THREAD:
+        _background.spawn(append_cached_exchange(new_message.content, answer, username))
+    return answer, _thread_registry.peek_thread(username)
+
+
+def remember_answer(new_message, username, answer, batch):
+    """Cache the answer to a prompt, unless the run also answered other prompts.
+
+    A coalesced run replies to every prompt of its batch at once, maybe with
+    details from the user's other prompts; it must not be served to others for this one.
+    """
+    if len(batch.prompts) > 1:
+        return
+    if answer and _answer_cache.is_eligible(new_message.content, username, new_message.use_cache):
+        _background.spawn(_answer_cache.put(new_message.content, answer))
+
+
+async def interact_with_assistant(prompt, username):
+    """Answer the prompt on the user's thread.
+
+    Prompts sent while a run is active on the thread share the follow-up run
+    and its reply. Returns the reply, the thread id and the Batch that answered.
+    """
+    batch, thread_id = await submit_prompt(prompt, username)
+    response = [delta async for delta in batch.stream()]
+    return "".join(response), thread_id, batch
+
+# Authentication and Token Management
+async def authenticate_user(username: str, password: str, db: _asyncio.AsyncSession = Depends(_services.get_async_db)):
+    return await _auth.authenticate_user(db, username, password)
 
 @app.post('/api/token', tags=["User"])
-async def generate_token(form_data: OAuth2PasswordRequestForm= Depends(),  db: _orm.Session = Depends(_services.get_db)):
+async def generate_token(form_data: OAuth2PasswordRequestForm= Depends(),  db: _asyncio.AsyncSession = Depends(_services.get_async_db)):
     user = await authenticate_user(form_data.username, form_data.password, db=db)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail = 'Invalid Username or Password')
-    # user_obj = await User_Pydantic.from_tortoise_orm(user)
-    data = {
-        'username' : user.username,
-        'password_hash' : user.password_hash
-    }
-    token = jwt.encode(data, JWT_SECRET)
+    token = _auth.create_access_token(user)
     return {'access_token' : token, 'token_type': 'bearer'}
 
 
 # User Registration
 @app.post("/users/register", response_model=_schemas.User)
-async def create_user(user: _schemas.UserCreate, db: _orm.Session = Depends(_services.get_db)):
-    
-    # Load verified users from environment variable
-    verified_users = os.getenv("VERIFIED_USERS", "").split(",")
-    verified_usernames = set(verified_users)
-    print(f"Verified users loaded: {verified_usernames}")  # Debugging print
-    
-    # Check if the username is in the verified users list
-    print(f"Attempting to register user: {user.username}")  # Debugging print
-
-    if user.username not in verified_usernames:
-        print(f"Username {user.username} is not verified.")  # Debugging print
+async def create_user(user: _schemas.UserCreate, db: _asyncio.AsyncSession = Depends(_services.get_async_db)):
+    # Check if the username is on the registration allowlist
+    if not await _services.is_verified_user_async(db=db, username=user.username):
         raise HTTPException(
             status_code=400, detail="Username is not verified for registration."
         )
     # Check if the username already exists in the database.
-    
-    
-    db_user =  _services.get_user_by_username(db=db, username=user.username)
+    db_user = await _services.get_user_by_username_async(db=db, username=user.username)
     if db_user:
         raise HTTPException(
             status_code=400, detail="Username which is already in use."
         )
-    return _services.create_user(db=db, user=user)
+    password_hash = await _auth.hash_password(user.password)
+    return await _services.create_user_async(db=db, user=user, password_hash=password_hash)
+
+# Admin Endpoints
+async def get_admin_user(token: str = Depends(oauth2_scheme), db: _asyncio.AsyncSession = Depends(_services.get_async_db)):
+    user = await get_token(token, db)
+    if not user or user.username not in _config.ADMIN_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return user
+
+@app.post("/admin/users/import", response_model=_schemas.UserImportResult, tags=["Admin"])
+async def import_users(file: UploadFile = File(...), admin = Depends(get_admin_user)):
+    """Create accounts from an uploaded CSV (username,password) or JSONL file.
+
+    Existing usernames are skipped; imported usernames are added to the allowlist.
+    """
+    fmt = "jsonl" if (file.filename or "").endswith((".jsonl", ".ndjson")) else "csv"
+    try:
+        users = _provision.parse_users((await file.read()).decode("utf-8"), fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await asyncio.to_thread(_provision.import_users, users)
+
+@app.post("/admin/verified-users", tags=["Admin"])
+async def add_verified_users(verified: _schemas.VerifiedUsers, admin = Depends(get_admin_user),
+                             db: _asyncio.AsyncSession = Depends(_services.get_async_db)):
+    """Allow usernames to register through /users/register."""
+    added = await _services.add_verified_users_async(db=db, usernames=verified.usernames)
+    return {"added": added}
+
+@app.get("/admin/stats", tags=["Admin"])
+async def get_stats(admin = Depends(get_admin_user)):
+    """Queueing, cache, guard and thread compaction counters."""
+    return {
+        "admission": _admission.controller.stats(),
+        "runs": scheduler.stats(),
+        "threads": compactor.stats(),
+        "guard": _guard.stats(),
+        "answer_cache": _answer_cache.stats(),
+        "auth_cache": _auth.stats(),
+    }
+
+@app.get("/admin/profiles", tags=["Admin"])
+async def get_profiles(admin = Depends(get_admin_user)):
+    """Stored request profiles, newest first.
+
+    Send `X-Profile: 1` with an admin token to profile a request; the
+    response's `X-Profile-Id` header names its profile.
+    """
+    return await asyncio.to_thread(_profiling.list_profiles)
+
+@app.get("/admin/profiles/{name}", tags=["Admin"])
+async def get_profile(name: str, admin = Depends(get_admin_user)):
+    """Download a profile in pstats format (snakeviz, flameprof, python -m pstats)."""
+    path = _profiling.profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=name)
+
+@app.get("/healthz", tags=["Health"])
+async def healthz():
+    """Liveness: the process is serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz", tags=["Health"])
+async def readyz(response: Response):
+    """Readiness: 503 until the startup warmup (guard models, caches) has finished."""
+    if not _lifecycle.is_ready():
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return _lifecycle.status()
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(_metrics.render(), media_type="text/plain; version=0.0.4")
+
+async def validate_message(new_message: NewChatMessage):
+    """Run the guardrails on an incoming message, returning a ChatMessage carrying the error if it fails."""
+    try:
+        await _guard.validate(new_message.content)
+    except _guard.GuardBusy as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e),
+                            headers={"Retry-After": "1"})
+    except Exception as e:
+        return ChatMessage(
+        messageId=str(uuid.uuid4()),
+        sender=new_message.sender,
+        content= str(e),
+        timestamp=datetime.utcnow()
+        )
+    return None
+
+
+async def admit_run(username: str):
+    """Wait for an assistant run slot, answering 429 when the queue is full."""
+    try:
+        return await _admission.controller.acquire(username)
+    except _admission.Rejected as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e),
+                            headers={"Retry-After": str(e.retry_after)})
+
+
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+# Sent when a reply fails after it was accepted; the details are logged
+ASSISTANT_FAILED = "The assistant could not answer, please try again."
+
+
+async def reply_events(new_message, username, errorMessage, cached, ticket):
+    """Events answering one chat message: `delta` events, then a `message` event.
+
+    A guard rejection (`errorMessage`) is a single `message` event. `ticket`
+    is the admission slot of an uncached answer and is released here.
+    """
+    if errorMessage:
+        _metrics.CHAT_OUTCOMES.inc(outcome="rejected")
+        await _state.store.save_message(errorMessage, username)
+        yield "message", errorMessage
+        return
+
+    if cached:
+        _metrics.CHAT_OUTCOMES.inc(outcome="cached")
+        content, thread_id = cached
+        yield "delta", {"content": content}
+    else:
+        try:
+            with _metrics.STAGE_LATENCY.time(stage="assistant"):
+                batch, thread_id = await submit_prompt(new_message.content, username)
+                response = []
+                async for delta in batch.stream():
+                    response.append(delta)
+                    yield "delta", {"content": delta}
+        finally:
+            ticket.release()
+        _metrics.CHAT_OUTCOMES.inc(outcome="answered")
+        content = "".join(response)
+        remember_answer(new_message, username, content, batch)
+
+    message = ChatMessage(
+        messageId=str(uuid.uuid4()),
+        sender=new_message.sender,
+        content=content,
+        timestamp=datetime.utcnow(),
+        thread_id=thread_id
+    )
+    with _metrics.STAGE_LATENCY.time(stage="store"):
+        await _state.store.save_message(message, username)
+    yield "message", message
+
 
 # Chat Endpoints
+async def get_chat_user(token: str = Depends(oauth2_scheme), db: _asyncio.AsyncSession = Depends(_services.get_async_db)):
+    """The authenticated caller of a chat history endpoint."""
+    user = await get_token(token, db)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    # History is read through the shared state; no need to keep a pooled connection
+    await db.close()
+    return user
+
 @app.get("/chats", response_model=List[ChatMessage])
-def get_chats():
-    return chats
+async def get_chats(request: Request, cursor: int = 0, limit: int = Query(50, ge=1, le=500),
+                    user = Depends(get_chat_user)):
+    """The caller's chat history, oldest first, one page at a time.
+
+    History holds the replies and guard rejections sent to the caller; their
+    own prompts are not stored. Pass the `X-Next-Cursor` header of a page as
+    `cursor` to fetch the next one; the header is absent on the last page.
+
+    Pages carry ETag and Last-Modified; send them back as If-None-Match or
+    If-Modified-Since to get a 304 while the page is unchanged.
+    """
+    username = user.username
+    db_messages = await _state.store.get_messages(after=cursor, limit=limit, username=username)
+    # Messages are never edited, so a page only changes when messages are added to it
+    tag = _http_response.etag(cursor, limit, username, *(db_message.id for db_message in db_messages))
+    payload = [_http_response.message_dict(db_message) for db_message in db_messages]
+    if len(db_messages) < limit:
+        # The last page can still grow, within the second of Last-Modified too; only the ETag is reliable
+        return _http_response.json_response(request, payload, tag)
+    # A full page is final
+    return _http_response.json_response(
+        request, payload, tag, max(db_message.timestamp for db_message in db_messages),
+        cache_control="private, max-age=86400, immutable",
+        headers={"X-Next-Cursor": str(db_messages[-1].id)},
+    )
 
 @app.post("/chats", response_model=ChatMessage, status_code=201)
-async def post_chat(new_message: NewChatMessage, token: str = Depends(oauth2_scheme), db: _orm.Session = Depends(_services.get_db)):
+async def post_chat(new_message: NewChatMessage, token: str = Depends(oauth2_scheme), db: _asyncio.AsyncSession = Depends(_services.get_async_db)):
     #authentication
-    user = await get_token(token, db)    
+    with _metrics.STAGE_LATENCY.time(stage="auth"):
+        user = await get_token(token, db)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
     
     username = user.username
+    # Hand the pooled connection back before awaiting guardrails and the
+    # assistant, otherwise a burst of slow runs holds every pooled connection.
+    await db.close()
     
     
     #gaurdrails
-    # Setup Guard with the validator
-    guard = Guard().use_many(
-    NSFWText(threshold=0.8, validation_method="sentence", on_fail="exception"),
-    RestrictToTopic(
-        valid_topics=[
-            "uganda", "farm", "planting", "crops", 
-            "plant", "buyanga", "mbale", "namutumbas"
-        ],
-        disable_classifier=True,
-        disable_llm=False,
-        on_fail="exception"
-        ))
-    try:
-        # Test failing response
-        guard.validate(new_message.content)
-    except Exception as e:
-        errorMessage = ChatMessage(
-        messageId=str(uuid.uuid4()),
-        sender=new_message.sender,
-        content= str(e),
-        timestamp=datetime.utcnow()
-        )  
+    with _metrics.STAGE_LATENCY.time(stage="guard"):
+        errorMessage = await validate_message(new_message)
+    if errorMessage:
+        _metrics.CHAT_OUTCOMES.inc(outcome="rejected")
+        with _metrics.STAGE_LATENCY.time(stage="store"):
+            await _state.store.save_message(errorMessage, username)
         return errorMessage
         
     
-    # Interact with OpenAI assistant
-    response_content, thread_id = interact_with_assistant(new_message.content, username)
+    # Repeated questions are answered from the cache when allowed
+    cached = get_cached_answer(new_message, username)
+    if cached:
+        _metrics.CHAT_OUTCOMES.inc(outcome="cached")
+        response_content, thread_id = cached
+    else:
+        # Interact with OpenAI assistant, once a run slot is free
+        with _metrics.STAGE_LATENCY.time(stage="admission"):
+            ticket = await admit_run(username)
+        try:
+            with _metrics.STAGE_LATENCY.time(stage="assistant"):
+                response_content, thread_id, batch = await interact_with_assistant(new_message.content, username)
+        finally:
+            ticket.release()
+        _metrics.CHAT_OUTCOMES.inc(outcome="answered")
+        remember_answer(new_message, username, response_content, batch)
 
     # Create a response message
     message = ChatMessage(
@@ -237,37 +472,189 @@ async def post_chat(new_message: NewChatMessage, token: str = Depends(oauth2_sch
         timestamp=datetime.utcnow(),
         thread_id=thread_id
     )
+    with _metrics.STAGE_LATENCY.time(stage="store"):
+        await _state.store.save_message(message, username)
 
     # Return the response
     return message
 
+@app.post("/chats/stream")
+async def post_chat_stream(new_message: NewChatMessage, token: str = Depends(oauth2_scheme), db: _asyncio.AsyncSession = Depends(_services.get_async_db)):
+    """Streaming variant of POST /chats.
+
+    Sends a `delta` event for every cleaned chunk of the assistant reply as it
+    arrives and finishes with a `message` event holding the full ChatMessage.
+    Guard rejections are sent as a single `message` event. A reply that fails
+    after the response started ends with an `error` event instead.
+    """
+    with _metrics.STAGE_LATENCY.time(stage="auth"):
+        user = await get_token(token, db)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    username = user.username
+    await db.close()
+
+    with _metrics.STAGE_LATENCY.time(stage="guard"):
+        errorMessage = await validate_message(new_message)
+    cached = None if errorMessage else get_cached_answer(new_message, username)
+    # Admit before the response starts, so a full queue is still a 429
+    ticket = None
+    if not errorMessage and not cached:
+        with _metrics.STAGE_LATENCY.time(stage="admission"):
+            ticket = await admit_run(username)
+
+    async def event_stream():
+        try:
+            async with contextlib.aclosing(reply_events(new_message, username, errorMessage, cached, ticket)) as events:
+                async for event, data in events:
+                    yield sse_event(event, data)
+        except Exception:
+            # The 200 is already sent: a terminal event rather than a cut connection
+            logger.exception("Streamed assistant reply failed")
+            _metrics.CHAT_OUTCOMES.inc(outcome="failed")
+            yield sse_event("error", {"status": 502, "detail": ASSISTANT_FAILED})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Frees the slot if the client left before the stream started
+        background=BackgroundTask(ticket.release) if ticket else None,
+    )
+
 @app.get("/chats/{messageId}", response_model=ChatMessage)
-def get_chat(messageId: str):
-    for chat in chats:
-        if chat.messageId == messageId:
-            return chat
-    raise HTTPException(status_code=404, detail="Message not found")
+async def get_chat(request: Request, messageId: str, user = Depends(get_chat_user)):
+    db_message = await _state.store.get_message(messageId)
+    # Other users' messages are indistinguishable from missing ones
+    if db_message is None or db_message.username != user.username:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return _http_response.json_response(
+        request, _http_response.message_dict(db_message),
+        _http_response.etag(db_message.message_id), db_message.timestamp,
+        # Messages never change
+        cache_control="private, max-age=86400, immutable",
+    )
+
+# WebSocket chat channel
+REPLAY_PAGE_SIZE = 100
+
+
+async def replay_messages(connection, username, after):
+    """Send the user's messages stored after message `after`, e.g. those missed while offline."""
+    db_message = await _state.store.get_message(after)
+    if db_message is None or db_message.username != username:
+        await connection.send({"type": "error", "status": 404, "detail": "Resume point not found"})
+        return
+    cursor = db_message.id
+    while True:
+        db_messages = await _state.store.get_messages(after=cursor, limit=REPLAY_PAGE_SIZE, username=username)
+        for db_message in db_messages:
+            await connection.send({"type": "message", "replayed": True,
+                                   "message": _http_response.message_dict(db_message)})
+        if len(db_messages) < REPLAY_PAGE_SIZE:
+            return
+        cursor = db_messages[-1].id
+
+
+async def answer_over_websocket(connection, username, frame):
+    """Answer one `message` frame with the same events POST /chats/stream sends."""
+    client_id = frame.get("client_id")
+    try:
+        new_message = NewChatMessage(sender=frame.get("sender", username), content=frame.get("content"),
+                                     thread_id=frame.get("thread_id"), use_cache=frame.get("use_cache", True))
+    except ValueError as e:
+        await connection.send({"type": "error", "client_id": client_id, "status": 422, "detail": str(e)})
+        return
+
+    ticket = None
+    try:
+        with _metrics.STAGE_LATENCY.time(stage="guard"):
+            errorMessage = await validate_message(new_message)
+        cached = None if errorMessage else get_cached_answer(new_message, username)
+        if not errorMessage and not cached:
+            with _metrics.STAGE_LATENCY.time(stage="admission"):
+                ticket = await admit_run(username)
+    except HTTPException as e:
+        await connection.send({"type": "error", "client_id": client_id, "status": e.status_code,
+                               "detail": e.detail, "retry_after": (e.headers or {}).get("Retry-After")})
+        return
+
+    try:
+        async with contextlib.aclosing(reply_events(new_message, username, errorMessage, cached, ticket)) as events:
+            async for event, data in events:
+                # Waits while the send buffer is full, which holds back this reply only
+                await connection.send({"type": event, "client_id": client_id,
+                                       **({"message": data} if event == "message" else data)})
+    except _ws_connection.Closed:
+        raise
+    except Exception:
+        # Otherwise the client waits for this client_id forever
+        logger.exception("Assistant reply over WebSocket failed")
+        _metrics.CHAT_OUTCOMES.inc(outcome="failed")
+        await connection.send({"type": "error", "client_id": client_id, "status": 502, "detail": ASSISTANT_FAILED})
+    finally:
+        if ticket:
+            ticket.release()
+
+
+@app.websocket("/ws")
+async def chat_websocket(websocket: WebSocket, token: Optional[str] = None, after: Optional[str] = None,
+                         db: _asyncio.AsyncSession = Depends(_services.get_async_db)):
+    """Chat over one long-lived connection.
+
+    Authenticate with the `/api/token` JWT as the `token` query parameter or an
+    `Authorization: Bearer` header. Send `{"type": "message", "content": ...,
+    "client_id": ...}` frames; each is answered with `delta` frames and a final
+    `message` frame holding the ChatMessage (a guard rejection is a `message`
+    frame only), all carrying the frame's `client_id`. Failures are `error`
+    frames with an HTTP status. Pass the messageId of the last message
+    received as `after` to first get the messages sent since.
+
+    The server sends `ping` frames; any frame counts as an answer, `pong`
+    being the cheapest. `ping` frames from the client are answered with `pong`.
+    """
+    if token is None:
+        scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+        token = credentials if scheme.lower() == "bearer" else None
+    try:
+        user = await get_token(token, db) if token else None
+    except HTTPException:
+        user = None
+    await db.close()
+    if not user:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    username = user.username
+    await websocket.accept()
+    connection = _ws_connection.Connection(websocket, username)
+
+    async def handle(frame):
+        kind = frame.get("type") if isinstance(frame, dict) else None
+        if kind == "message":
+            connection.spawn(answer_over_websocket(connection, username, frame))
+        elif kind == "ping":
+            await connection.send({"type": "pong"})
+        elif kind != "pong":
+            await connection.send({"type": "error", "status": 400, "detail": f"Unknown frame type {kind!r}"})
+
+    # Missed messages go out before any new frame is read, so they arrive first
+    await connection.serve(handle, start=replay_messages(connection, username, after) if after else None)
 
 # Items Endpoint (Example secured endpoint)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-async def get_token(token: str = Depends(oauth2_scheme),  db: _orm.Session = Depends(_services.get_db)):
+async def get_token(token: str = Depends(oauth2_scheme),  db: _asyncio.AsyncSession = Depends(_services.get_async_db)):
+    """Resolve a bearer token to its user; both steps are cached on the hot path."""
     try:
-        print("get_token")
-        payload = jwt.decode(token , JWT_SECRET, algorithms=['HS256'])
-        # user = await User.get(id=payload.get('id'))
-        username = payload.get('username')
-        print(f'username {username}')
-        user = _services.get_user_by_username(db=db,username=payload.get('username'))
-        # user: str = payload.get("username")
-        # print(f'username {user}')
-    except:
+        username = _auth.verify_token(token)
+    except _auth.InvalidToken:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
         detail = 'Invalid Username or Password')
-    return user
+    return await _services.get_cached_user_async(db=db, username=username)
 
 @app.post("/items/")
-async def get_items(str: Optional[str], token: str = Depends(oauth2_scheme), db: _orm.Session = Depends(_services.get_db)):
+async def get_items(str: Optional[str], token: str = Depends(oauth2_scheme), db: _asyncio.AsyncSession = Depends(_services.get_async_db)):
     user = await get_token(token, db)    
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
@@ -0,0 +1,182 @@
+#metrics.py
+
+import bisect
+import contextlib
+import threading
+import time
+
+# Seconds; assistant runs can take tens of seconds, DB queries well under one
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the with-block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _labels(self.labelnames, key, [("le", _number(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+
+
+class Callback(_Metric):
+    """A gauge or counter read from `fn` at scrape time.
+
+    `fn` returns a number, or with a `labelname` a dict of label value -> number.
+    """
+
+    def __init__(self, name: str, help: str, fn, kind: str = "gauge", labelname: str = None):
+        super().__init__(name, help, (labelname,) if labelname else ())
+        self.kind = kind
+        self.fn = fn
+
+    def samples(self):
+        value = self.fn()
+        values = sorted(value.items()) if self.labelnames else [((), value)]
+        for label, number in values:
+            if number is None:
+                continue
+            key = (label,) if self.labelnames else ()
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(number)}"
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds",
+                         "Time from request start to the last response byte.", ("method", "route"))
+STAGE_LATENCY = Histogram("chat_stage_duration_seconds",
+                          "Time spent in each stage of POST /chats and /chats/stream.", ("stage",))
+CHAT_OUTCOMES = Counter("chat_messages_total", "Chat messages by how they were answered.", ("outcome",))
+ASSISTANT_LATENCY = Histogram("assistant_run_duration_seconds",
+                              "Assistant time to the first delta, to the end of the reply, and output checks after it.", ("phase",))
+OUTPUT_GUARD = Counter("output_guard_sentences_total", "Reply sentences by output guard outcome.", ("outcome",))
+DB_LATENCY = Histogram("db_query_duration_seconds", "Database statement execution time.", ("engine", "operation"))
+THREAD_RUN_LATENCY = Histogram("assistant_run_by_thread_length_seconds",
+                               "Assistant run time by messages on the thread when it started.", ("thread_messages",))
+THREAD_COMPACTIONS = Counter("thread_compactions_total", "Thread compactions by outcome.", ("outcome",))
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing them until the response is sent.
+
+    Requests are labelled with the matched route template, so /chats/{messageId}
+    is one series; requests matching no route share the route "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(method=scope["method"], route=route, status=str(status))
+            HTTP_LATENCY.observe(time.perf_counter() - started, method=scope["method"], route=route)
@@ -11,4 +11,61 @@ class User(_database.Base):
     __tablename__ = "users"
     id = _sql.Column(_sql.Integer, primary_key=True, index=True)
     username = _sql.Column(_sql.String, unique=True, index=True)
-    password_hash = _sql.Column(_sql.String)
\ No newline at end of file
+    password_hash = _sql.Column(_sql.String)
+
+class UserThread(_database.Base):
+    __tablename__ = "user_threads"
+    id = _sql.Column(_sql.Integer, primary_key=True, index=True)
+    username = _sql.Column(_sql.String, unique=True, index=True)
+    thread_id = _sql.Column(_sql.String)
+    date_created = _sql.Column(_sql.DateTime, default=_dt.datetime.utcnow)
+
+
+class CachedAnswer(_database.Base):
+    __tablename__ = "cached_answers"
+    id = _sql.Column(_sql.Integer, primary_key=True, index=True)
+    key = _sql.Column(_sql.String, unique=True, index=True)
+    prompt = _sql.Column(_sql.String)
+    answer = _sql.Column(_sql.String)
+    expires_at = _sql.Column(_sql.DateTime, index=True)
+
+
+class ChatMessage(_database.Base):
+    __tablename__ = "chat_messages"
+    # Monotonic id, doubles as the pagination cursor of GET /chats
+    id = _sql.Column(_sql.Integer, primary_key=True, index=True)
+    message_id = _sql.Column(_sql.String, unique=True, index=True)
+    username = _sql.Column(_sql.String, index=True)
+    sender = _sql.Column(_sql.String)
+    content = _sql.Column(_sql.Text)
+    thread_id = _sql.Column(_sql.String, nullable=True)
+    timestamp = _sql.Column(_sql.DateTime, index=True, default=_dt.datetime.utcnow)
+
+    __table_args__ = (_sql.Index("ix_chat_messages_username_id", "username", "id"),)
+
+
+class VerifiedUser(_database.Base):
+    """Usernames allowed to register."""
+    __tablename__ = "verified_users"
+    id = _sql.Column(_sql.Integer, primary_key=True, index=True)
+    username = _sql.Column(_sql.String, unique=True, index=True)
+    date_created = _sql.Column(_sql.DateTime, default=_dt.datetime.utcnow)
+
+
+class ThreadLease(_database.Base):
+    """Held by the worker process running the assistant on a thread."""
+    __tablename__ = "thread_leases"
+    id = _sql.Column(_sql.Integer, primary_key=True, index=True)
+    thread_id = _sql.Column(_sql.String, unique=True, index=True)
+    owner = _sql.Column(_sql.String)
+    expires_at = _sql.Column(_sql.DateTime)
+
+
+class ThreadUsage(_database.Base):
+    """Running size of an assistant thread, counted from the runs made on it."""
+    __tablename__ = "thread_usage"
+    id = _sql.Column(_sql.Integer, primary_key=True, index=True)
+    thread_id = _sql.Column(_sql.String, unique=True, index=True)
+    messages = _sql.Column(_sql.Integer, default=0)
+    tokens = _sql.Column(_sql.Integer, default=0)
+    updated_at = _sql.Column(_sql.DateTime, default=_dt.datetime.utcnow)
@@ -0,0 +1,118 @@
+#output_guard.py
+
+import asyncio
+import logging
+import re
+import time
+
+import config as _config, guard as _guard, metrics as _metrics
+
+logger = logging.getLogger(__name__)
+
+# End of a sentence: terminal punctuation (and closing quotes/brackets) followed by
+# whitespace, or a line break. "2.5 kg" is not split.
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*\s+|\n+")
+
+_END = object()
+
+
+def _check(sentence: str):
+    """Start validating a sentence; blank ones need no check."""
+    return asyncio.ensure_future(_guard.validate_output(sentence)) if sentence.strip() else None
+
+
+def _discard(check):
+    if check is None:
+        return
+    if check.done() and not check.cancelled():
+        check.exception()  # retrieved, so asyncio does not log it
+    else:
+        check.cancel()
+
+
+def _split(buffer: str):
+    """Complete sentences at the start of `buffer`, and the unfinished rest."""
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(buffer):
+        sentences.append(buffer[start:match.end()])
+        start = match.end()
+    rest = buffer[start:]
+    if len(rest) > _config.OUTPUT_GUARD_MAX_CHARS:
+        # A run-on "sentence": check it in pieces, cut at the last space
+        cut = rest.rfind(" ", 0, _config.OUTPUT_GUARD_MAX_CHARS) + 1 or _config.OUTPUT_GUARD_MAX_CHARS
+        sentences.append(rest[:cut])
+        rest = rest[cut:]
+    return sentences, rest
+
+
+class OutputGuard:
+    """Validates a streamed reply sentence by sentence with the guard's NSFW validator.
+
+    Each sentence is sent for validation as soon as it is complete, while the
+    assistant keeps generating, and is passed on once it is cleared, in
+    order. A failing sentence is replaced by OUTPUT_GUARD_NOTICE
+    (action "redact") or ends the reply after the notice (action "stop").
+    After the last token only the final sentence is still being checked.
+    """
+
+    def __init__(self, action: str):
+        if action not in ("redact", "stop"):
+            raise ValueError(f"Unknown output guard action {action!r}, expected redact or stop")
+        self.action = action
+
+    async def _produce(self, deltas, checks: asyncio.Queue):
+        """Cut the deltas into sentences and start checking each one right away."""
+        buffer = ""
+        try:
+            async for delta in deltas:
+                sentences, buffer = _split(buffer + delta)
+                for sentence in sentences:
+                    checks.put_nowait((sentence, _check(sentence)))
+            if buffer:
+                checks.put_nowait((buffer, _check(buffer)))
+            checks.put_nowait((_END, time.perf_counter()))
+        except Exception as e:
+            checks.put_nowait((_END, e))
+
+    async def apply(self, deltas):
+        checks = asyncio.Queue()
+        producer = asyncio.ensure_future(self._produce(deltas, checks))
+        try:
+            while True:
+                sentence, check = await checks.get()
+                if sentence is _END:
+                    if isinstance(check, Exception):
+                        raise check
+                    _metrics.ASSISTANT_LATENCY.observe(time.perf_counter() - check, phase="output_guard_tail")
+                    return
+                if check is None:
+                    yield sentence
+                    continue
+                try:
+                    await check
+                except Exception as e:
+                    logger.warning("Output guard removed a sentence: %s", e)
+                    _metrics.OUTPUT_GUARD.inc(outcome=self.action)
+                    yield _config.OUTPUT_GUARD_NOTICE + (" " if sentence[-1:].isspace() else "")
+                    if self.action == "stop":
+                        return
+                else:
+                    _metrics.OUTPUT_GUARD.inc(outcome="passed")
+                    yield sentence
+        finally:
+            # Let the producer unwind first, so the assistant stream it reads is closed
+            # before the caller decides whether the run still has to be cancelled
+            producer.cancel()
+            await asyncio.wait([producer])
+            while not checks.empty():
+                sentence, check = checks.get_nowait()
+                if sentence is not _END:
+                    _discard(check)
+
+
+def apply(deltas):
+    """Pass `deltas` through the output guard configured by OUTPUT_GUARD, if any."""
+    if _config.OUTPUT_GUARD == "off" or not _guard.output_checks_enabled():
+        return deltas
+    return OutputGuard(_config.OUTPUT_GUARD).apply(deltas)
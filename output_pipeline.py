@@ -0,0 +1,142 @@
+#output_pipeline.py
+
+import re
+
+import config as _config
+
+# OpenAI file-search citations, e.g. 【4:0†source】
+_CITATION = re.compile(r"【\d+:\d+†[^】\n]*】")
+# What a citation cut off by the end of a delta can look like so far
+_CITATION_PREFIX = re.compile(r"【(?:\d+(?::(?:\d+(?:†[^】\n]*)?)?)?)?\Z")
+# Longer "citations" are let through rather than buffered without bound
+_CITATION_MAX = 256
+
+_SPACE_RUN = re.compile(r"(?<=\S)[ \t]{2,}")
+_SPACE_BEFORE_NEWLINE = re.compile(r"[ \t]+\n")
+
+
+class StreamFilter:
+    """One stage of the output pipeline.
+
+    A new instance handles each reply. feed() takes the next chunk of text and
+    returns what can be passed on already, holding back at most a bounded
+    tail; flush() returns the held-back text once the reply has ended.
+    """
+
+    def feed(self, text: str) -> str:
+        return text
+
+    def flush(self) -> str:
+        return ""
+
+
+class CitationStripper(StreamFilter):
+    """Removes citation markers, including those split across deltas."""
+
+    def __init__(self):
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        if not self._pending and "【" not in text:
+            return text
+        text = self._pending + text
+        self._pending = ""
+        out = []
+        while True:
+            start = text.find("【")
+            if start < 0:
+                out.append(text)
+                break
+            out.append(text[:start])
+            text = text[start:]
+            match = _CITATION.match(text)
+            if match:
+                text = text[match.end():]
+            elif len(text) <= _CITATION_MAX and _CITATION_PREFIX.match(text):
+                # Possibly a marker whose end is still to come
+                self._pending = text
+                break
+            else:
+                out.append(text[0])
+                text = text[1:]
+        return "".join(out)
+
+    def flush(self) -> str:
+        pending, self._pending = self._pending, ""
+        return pending
+
+
+class WhitespaceNormalizer(StreamFilter):
+    """Collapses runs of spaces inside a line, such as those left by removed citations,
+    and drops trailing spaces. Indentation at the start of a line is kept."""
+
+    def __init__(self):
+        self._pending = ""  # trailing spaces, kept until we know what follows
+        self._last = ""     # last character passed on
+
+    def feed(self, text: str) -> str:
+        text = self._pending + text
+        body = text.rstrip(" \t")
+        self._pending = text[len(body):]
+        if not body:
+            return ""
+        body = _SPACE_BEFORE_NEWLINE.sub("\n", body)
+        body = _SPACE_RUN.sub(" ", self._last + body)[len(self._last):]
+        self._last = body[-1]
+        return body
+
+    def flush(self) -> str:
+        self._pending = ""
+        return ""
+
+
+# Filters OUTPUT_FILTERS can name; register() adds more
+FILTERS = {
+    "citations": CitationStripper,
+    "whitespace": WhitespaceNormalizer,
+}
+
+
+def register(name: str, factory):
+    """Make a StreamFilter factory available to OUTPUT_FILTERS under `name`."""
+    FILTERS[name] = factory
+
+
+class Pipeline:
+    """StreamFilters applied in order to the deltas of one reply."""
+
+    def __init__(self, filters):
+        self.filters = list(filters)
+
+    def feed(self, text: str) -> str:
+        for stream_filter in self.filters:
+            if not text:
+                break
+            text = stream_filter.feed(text)
+        return text
+
+    def flush(self) -> str:
+        text = ""
+        for stream_filter in self.filters:
+            text = (stream_filter.feed(text) if text else "") + stream_filter.flush()
+        return text
+
+    async def apply(self, deltas):
+        """Filter an async iterator of deltas, dropping the ones that come out empty."""
+        async for delta in deltas:
+            text = self.feed(delta)
+            if text:
+                yield text
+        text = self.flush()
+        if text:
+            yield text
+
+
+def build(names=None) -> Pipeline:
+    """A fresh pipeline of the named filters, OUTPUT_FILTERS by default."""
+    if names is None:
+        names = _config.OUTPUT_FILTERS
+    unknown = [name for name in names if name not in FILTERS]
+    if unknown:
+        raise ValueError(f"Unknown output filters {unknown}, expected some of {sorted(FILTERS)}")
+    return Pipeline(FILTERS[name]() for name in names)
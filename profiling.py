@@ -0,0 +1,138 @@
+#profiling.py
+
+"""Opt-in cProfile capture of whole requests.
+
+A request is profiled when an admin sends `X-Profile: 1` or when it is
+picked by PROFILE_SAMPLE_RATE. Profiles are pstats files, readable with
+`python -m pstats` and rendered as flame graphs by snakeviz or flameprof;
+the newest PROFILE_MAX_FILES are kept in PROFILE_DIR.
+
+cProfile follows the event loop thread only, so work handed to executor
+threads (guard validators, bcrypt) shows up as time spent awaiting it, and
+other requests served by the loop at the same time appear in the profile too.
+One request is profiled at a time; others run unprofiled meanwhile.
+"""
+
+import asyncio
+import cProfile
+import datetime as _dt
+import os
+import random
+import re
+import uuid
+
+import auth as _auth, config as _config
+
+# Requests to these paths are never profiled
+_EXCLUDED = ("/metrics", "/admin/profiles")
+_NAME = re.compile(r"^[\w.-]+\.prof$")
+
+_active = False
+
+
+def _is_admin(scope) -> bool:
+    """Whether the request carries `X-Profile: 1` and an admin's bearer token."""
+    headers = dict(scope["headers"])
+    if headers.get(b"x-profile") != b"1":
+        return False
+    scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer":
+        return False
+    try:
+        return _auth.verify_token(token) in _config.ADMIN_USERS
+    except _auth.InvalidToken:
+        return False
+
+
+def _should_profile(scope) -> bool:
+    if _active or scope["path"].startswith(_EXCLUDED):
+        return False
+    if _config.PROFILE_SAMPLE_RATE > 0 and random.random() < _config.PROFILE_SAMPLE_RATE:
+        return True
+    return _is_admin(scope)
+
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^\w]+", "_", text).strip("_") or "root"
+
+
+def _save(profiler: cProfile.Profile, name: str):
+    os.makedirs(_config.PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(os.path.join(_config.PROFILE_DIR, name))
+    # Ring buffer: drop the oldest profiles beyond PROFILE_MAX_FILES
+    for old in list_profiles()[_config.PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(_config.PROFILE_DIR, old["name"]))
+        except FileNotFoundError:
+            pass
+
+
+def list_profiles():
+    """Stored profiles, newest first."""
+    try:
+        entries = [entry for entry in os.scandir(_config.PROFILE_DIR) if _NAME.match(entry.name)]
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        profiles.append({
+            "name": entry.name,
+            "size": stat.st_size,
+            "created": _dt.datetime.utcfromtimestamp(stat.st_mtime),
+        })
+    profiles.sort(key=lambda profile: (profile["created"], profile["name"]), reverse=True)
+    return profiles
+
+
+def profile_path(name: str):
+    """Path of a stored profile, or None for unknown or malformed names."""
+    if not _NAME.match(name):
+        return None
+    path = os.path.join(_config.PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling selected requests from the first byte in to the last byte out.
+
+    Profiled responses carry an `X-Profile-Id` header naming the profile file.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _should_profile(scope):
+            return await self.app(scope, receive, send)
+
+        global _active
+        _active = True
+        stamp = _dt.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        suffix = uuid.uuid4().hex[:6]
+        name = None
+
+        def profile_name():
+            # The route is known once routing ran, i.e. by the time the response starts
+            route = getattr(scope.get("route"), "path", None) or scope["path"]
+            return f"{stamp}-{suffix}-{scope['method']}-{_slug(route)}.prof"
+
+        async def send_wrapper(message):
+            nonlocal name
+            if message["type"] == "http.response.start":
+                name = profile_name()
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", name.encode())]
+            await send(message)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.disable()
+            _active = False
+            await asyncio.to_thread(_save, profiler, name or profile_name())
@@ -0,0 +1,120 @@
+#provision.py
+"""Bulk user provisioning.
+
+    python provision.py farmers.csv [--batch-size 200] [--workers 4]
+
+Reads a CSV with `username,password` columns (extra columns are ignored) or
+a JSONL file of {"username": ..., "password": ...} objects. Usernames that
+already have an account are skipped, so the same file can be imported
+again safely. Every imported username is also put on the registration
+allowlist.
+"""
+
+import argparse
+import concurrent.futures as _futures
+import csv
+import io
+import json
+import logging
+import multiprocessing
+import os
+
+from passlib.hash import bcrypt
+
+import config as _config, database as _database, schemas as _schemas, services as _services
+
+logger = logging.getLogger(__name__)
+
+
+def _hash_password(password: str) -> str:
+    # Top level so it can be sent to pool processes
+    return bcrypt.hash(password)
+
+
+def parse_users(text: str, fmt: str):
+    """Parse CSV or JSONL text into UserCreate objects, keeping the first row per username."""
+    if fmt == "jsonl":
+        rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+    elif fmt == "csv":
+        rows = list(csv.DictReader(io.StringIO(text)))
+    else:
+        raise ValueError(f"Unsupported format {fmt!r}, expected csv or jsonl")
+
+    users = {}
+    for row in rows:
+        username = (row.get("username") or "").strip()
+        password = row.get("password") or ""
+        if not username or not password:
+            raise ValueError(f"Row without username or password: {row.get('username')!r}")
+        users.setdefault(username, _schemas.UserCreate(username=username, password=password))
+    return list(users.values())
+
+
+def read_users(path: str):
+    fmt = "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+    with open(path, "r", newline="") as file:
+        return parse_users(file.read(), fmt)
+
+
+def import_users(users, batch_size: int = 200, workers: int = None):
+    """Create accounts for `users`, hashing passwords across a process pool.
+
+    Each batch is hashed in parallel and inserted in one transaction through
+    services.create_user. Returns a UserImportResult.
+    """
+    workers = workers or os.cpu_count() or 1
+    created = skipped = 0
+    db = _database.SessionLocal()
+    try:
+        # spawn, not fork: this also runs inside the server process and its threads
+        with _futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            for start in range(0, len(users), batch_size):
+                batch = users[start:start + batch_size]
+                existing = _services.get_existing_usernames(db=db, usernames=[user.username for user in batch])
+                new_users = [user for user in batch if user.username not in existing]
+                skipped += len(batch) - len(new_users)
+
+                password_hashes = executor.map(
+                    _hash_password, [user.password for user in new_users],
+                    chunksize=max(1, len(new_users) // (workers * 4)),
+                )
+                for user, password_hash in zip(new_users, password_hashes):
+                    _services.create_user(db=db, user=user, password_hash=password_hash, commit=False)
+                db.commit()
+                created += len(new_users)
+                logger.info("Imported %d users, skipped %d", created, skipped)
+
+        _services.add_verified_users(db=db, usernames=[user.username for user in users])
+    finally:
+        db.close()
+    return _schemas.UserImportResult(created=created, skipped=skipped)
+
+
+def import_env_allowlist():
+    """Copy the legacy VERIFIED_USERS env allowlist into the verified_users table."""
+    if not _config.VERIFIED_USERS:
+        return 0
+    db = _database.SessionLocal()
+    try:
+        return _services.add_verified_users(db=db, usernames=_config.VERIFIED_USERS)
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create user accounts from a CSV or JSONL file.")
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=None, help="hashing processes, defaults to the CPU count")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    _services.create_database()
+    result = import_users(read_users(args.path), batch_size=args.batch_size, workers=args.workers)
+    print(f"created {result.created}, skipped {result.skipped}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#run_scheduler.py
+
+import asyncio
+import collections
+import contextlib
+import time
+
+import background as _background
+
+_DONE = object()
+
+
+class Batch:
+    """Prompts answered together by one assistant run.
+
+    Every request whose prompt is in the batch can stream the run's deltas
+    and receives the combined reply.
+    """
+
+    def __init__(self, prompt: str):
+        self.prompts = [prompt]
+        self.deltas = []
+        self.error = None
+        self.done = False
+        self._listeners = []
+
+    def _publish(self, item):
+        for listener in self._listeners:
+            listener.put_nowait(item)
+
+    def add_delta(self, delta: str):
+        self.deltas.append(delta)
+        self._publish(delta)
+
+    def finish(self, error: Exception = None):
+        self.error = error
+        self.done = True
+        self._publish(_DONE)
+
+    async def stream(self):
+        """Yield the run's deltas, including those sent before the caller subscribed."""
+        listener = asyncio.Queue()
+        for delta in self.deltas:
+            listener.put_nowait(delta)
+        if self.done:
+            listener.put_nowait(_DONE)
+        else:
+            self._listeners.append(listener)
+        try:
+            while True:
+                item = await listener.get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+        if self.error is not None:
+            raise self.error
+
+
+class RunScheduler:
+    """Serializes assistant runs per thread and coalesces messages that arrive mid-run.
+
+    OpenAI refuses a second run, or a new message, on a thread while a run
+    is active. The first prompt for an idle thread starts a run right away;
+    prompts arriving while it is active are collected into one pending batch
+    that is appended to the thread and answered by a single follow-up run.
+
+    `add_message(thread_id, prompt)` and `stream_run(thread_id)` (an async
+    iterator of text deltas) do the actual assistant calls. `lease(thread_id)`,
+    an async context manager, extends the per-thread lock to other processes.
+    `on_run(thread_id, prompts, reply, seconds)`, a coroutine function, is
+    started in the background after every successful run.
+    """
+
+    def __init__(self, add_message, stream_run, lease=None, on_run=None):
+        self._add_message = add_message
+        self._stream_run = stream_run
+        self._lease = lease
+        self._on_run = on_run
+        self._running = set()
+        self._pending = {}
+        # thread_id -> lock, kept only while someone holds or waits for it
+        self._locks = {}
+        self._lock_users = collections.Counter()
+        self.runs = 0
+        self.coalesced = 0
+
+    @contextlib.asynccontextmanager
+    async def lock(self, thread_id: str):
+        """Held while a thread is being written to; take it for any other thread writes."""
+        lock = self._locks.setdefault(thread_id, asyncio.Lock())
+        self._lock_users[thread_id] += 1
+        try:
+            async with lock:
+                if self._lease is None:
+                    yield
+                else:
+                    async with self._lease(thread_id):
+                        yield
+        finally:
+            # Threads come and go (compaction retires them): drop locks nobody needs
+            self._lock_users[thread_id] -= 1
+            if not self._lock_users[thread_id]:
+                del self._lock_users[thread_id]
+                del self._locks[thread_id]
+
+    def submit(self, thread_id: str, prompt: str) -> Batch:
+        if thread_id not in self._running:
+            batch = Batch(prompt)
+            self._running.add(thread_id)
+            _background.spawn(self._drive(thread_id, batch))
+            return batch
+
+        batch = self._pending.get(thread_id)
+        if batch is None:
+            batch = self._pending[thread_id] = Batch(prompt)
+        else:
+            batch.prompts.append(prompt)
+            self.coalesced += 1
+        return batch
+
+    async def _drive(self, thread_id: str, batch: Batch):
+        try:
+            while batch is not None:
+                try:
+                    async with self.lock(thread_id):
+                        for prompt in batch.prompts:
+                            await self._add_message(thread_id, prompt)
+                        self.runs += 1
+                        started = time.perf_counter()
+                        async for delta in self._stream_run(thread_id):
+                            batch.add_delta(delta)
+                        seconds = time.perf_counter() - started
+                except Exception as e:
+                    batch.finish(e)
+                else:
+                    batch.finish()
+                    if self._on_run is not None:
+                        _background.spawn(self._on_run(thread_id, batch.prompts, "".join(batch.deltas), seconds))
+                batch = self._pending.pop(thread_id, None)
+        finally:
+            self._running.discard(thread_id)
+            # Only reached with nothing pending, unless cancelled: fail the waiters left behind
+            for leftover in (batch, self._pending.pop(thread_id, None)):
+                if leftover is not None and not leftover.done:
+                    leftover.finish(RuntimeError("Assistant run was cancelled"))
+
+    def stats(self):
+        return {
+            "active_threads": len(self._running),
+            "pending_batches": len(self._pending),
+            "thread_locks": len(self._locks),
+            "runs": self.runs,
+            "coalesced_messages": self.coalesced,
+        }
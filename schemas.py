@@ -15,4 +15,12 @@ class User(_UserBase):
     id: int
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class UserImportResult(_pydantic.BaseModel):
+    created: int
+    skipped: int
+
+
+class VerifiedUsers(_pydantic.BaseModel):
+    usernames: List[str]
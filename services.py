@@ -1,10 +1,24 @@
 #services.py
 
+import datetime as _dt
+
+import sqlalchemy as _sql
+import sqlalchemy.exc as _exc
+import sqlalchemy.ext.asyncio as _asyncio
 import sqlalchemy.orm as _orm
 
-import models as _models, schemas as _schemas, database as _database
+import models as _models, schemas as _schemas, database as _database, cache as _cache, config as _config
 from passlib.hash import bcrypt
 
+# username -> detached User, dropped whenever create_user touches that username
+_users = _cache.TTLCache(maxsize=_config.USER_CACHE_SIZE, ttl=_config.USER_CACHE_TTL)
+# username -> whether it is on the registration allowlist
+_verified = _cache.TTLCache(maxsize=_config.USER_CACHE_SIZE, ttl=_config.USER_CACHE_TTL)
+
+
+def stats():
+    return {"users": _users.stats(), "verified": _verified.stats()}
+
 
 def create_database():
     return _database.Base.metadata.create_all(bind=_database.engine)
@@ -21,13 +35,6 @@ def get_db():
 def get_user(db: _orm.Session, user_id: int):
     return db.query(_models.User).filter(_models.User.id == user_id).first()
 
-def verify_password(db: _orm.Session,username: str, password: str):
-    user_obj = db.query(_models.User).filter(_models.User.username == username).first()
-    # print(user_obj.password_hash)
-    # print(password)
-    # print(bcrypt.verify(password, user_obj.password_hash))
-    return bcrypt.verify(password, user_obj.password_hash)
-
 
 def get_user_by_username(db: _orm.Session, username: str):
     return db.query(_models.User).filter(_models.User.username == username).first()
@@ -37,9 +44,288 @@ def get_users(db: _orm.Session, skip: int = 0, limit: int = 100):
     return db.query(_models.User).offset(skip).limit(limit).all()
 
 
-def create_user(db: _orm.Session, user: _schemas.UserCreate):
-    db_user = _models.User(username=user.username, password_hash=bcrypt.hash(user.password))
+def create_user(db: _orm.Session, user: _schemas.UserCreate, password_hash: str = None, commit: bool = True):
+    """Insert a user; pass `password_hash` when the hash was computed elsewhere.
+
+    With commit=False the user is only added to the session, so callers can
+    insert many users in one transaction.
+    """
+    if password_hash is None:
+        password_hash = bcrypt.hash(user.password)
+    db_user = _models.User(username=user.username, password_hash=password_hash)
     db.add(db_user)
+    if commit:
+        db.commit()
+        db.refresh(db_user)
+    _users.pop(user.username)
+    return db_user
+
+
+def get_existing_usernames(db: _orm.Session, usernames):
+    """The subset of `usernames` that already have an account."""
+    rows = db.query(_models.User.username).filter(_models.User.username.in_(list(usernames))).all()
+    return {row.username for row in rows}
+
+
+def add_verified_users(db: _orm.Session, usernames):
+    """Put usernames on the registration allowlist, skipping ones already there."""
+    usernames = set(usernames)
+    rows = db.query(_models.VerifiedUser.username).filter(_models.VerifiedUser.username.in_(list(usernames))).all()
+    new_usernames = usernames - {row.username for row in rows}
+    db.add_all(_models.VerifiedUser(username=username) for username in new_usernames)
+    db.commit()
+    for username in usernames:
+        _verified.pop(username)
+    return len(new_usernames)
+
+
+def get_user_threads(db: _orm.Session):
+    return db.query(_models.UserThread).all()
+
+
+def create_user_thread(db: _orm.Session, username: str, thread_id: str):
+    db_thread = _models.UserThread(username=username, thread_id=thread_id)
+    db.add(db_thread)
+    db.commit()
+    db.refresh(db_thread)
+    return db_thread
+
+
+def get_cached_answers(db: _orm.Session, now: _dt.datetime, limit: int = 1024):
+    return (
+        db.query(_models.CachedAnswer)
+        .filter(_models.CachedAnswer.expires_at > now)
+        .order_by(_models.CachedAnswer.expires_at.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def delete_expired_answers(db: _orm.Session, now: _dt.datetime):
+    deleted = db.query(_models.CachedAnswer).filter(_models.CachedAnswer.expires_at <= now).delete()
     db.commit()
-    db.refresh(db_user)
-    return db_user
\ No newline at end of file
+    return deleted
+
+
+# Async versions, for use from async handlers; the sync ones above serve startup imports and scripts.
+# They take an AsyncSession from get_async_db / database.AsyncSessionLocal.
+
+async def create_database_async():
+    async with _database.async_engine.begin() as connection:
+        await connection.run_sync(_database.Base.metadata.create_all)
+
+
+async def warmup_async():
+    """Configure the ORM mappers and open a pooled connection ahead of the first request."""
+    _orm.configure_mappers()
+    async with _database.async_engine.connect() as connection:
+        await connection.execute(_sql.text("SELECT 1"))
+
+
+async def get_async_db():
+    async with _database.AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_user_async(db: _asyncio.AsyncSession, user_id: int):
+    result = await db.execute(_sql.select(_models.User).where(_models.User.id == user_id))
+    return result.scalars().first()
+
+
+async def get_user_by_username_async(db: _asyncio.AsyncSession, username: str):
+    result = await db.execute(_sql.select(_models.User).where(_models.User.username == username))
+    return result.scalars().first()
+
+
+async def get_cached_user_async(db: _asyncio.AsyncSession, username: str):
+    user = _users.get(username)
+    if user is None:
+        user = await get_user_by_username_async(db=db, username=username)
+        if user is not None:
+            db.expunge(user)
+            _users.set(username, user)
+    return user
+
+
+async def get_users_async(db: _asyncio.AsyncSession, skip: int = 0, limit: int = 100):
+    result = await db.execute(_sql.select(_models.User).offset(skip).limit(limit))
+    return result.scalars().all()
+
+
+async def create_user_async(db: _asyncio.AsyncSession, user: _schemas.UserCreate, password_hash: str):
+    """Insert a user; hash the password with auth.hash_password, off the event loop."""
+    db_user = _models.User(username=user.username, password_hash=password_hash)
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    _users.pop(user.username)
+    return db_user
+
+
+async def get_existing_usernames_async(db: _asyncio.AsyncSession, usernames):
+    result = await db.execute(
+        _sql.select(_models.User.username).where(_models.User.username.in_(list(usernames)))
+    )
+    return set(result.scalars().all())
+
+
+async def is_verified_user_async(db: _asyncio.AsyncSession, username: str):
+    verified = _verified.get(username)
+    if verified is None:
+        result = await db.execute(
+            _sql.select(_models.VerifiedUser.id).where(_models.VerifiedUser.username == username)
+        )
+        verified = result.first() is not None
+        _verified.set(username, verified)
+    return verified
+
+
+async def add_verified_users_async(db: _asyncio.AsyncSession, usernames):
+    usernames = set(usernames)
+    result = await db.execute(
+        _sql.select(_models.VerifiedUser.username).where(_models.VerifiedUser.username.in_(list(usernames)))
+    )
+    new_usernames = usernames - set(result.scalars().all())
+    db.add_all(_models.VerifiedUser(username=username) for username in new_usernames)
+    await db.commit()
+    for username in usernames:
+        _verified.pop(username)
+    return len(new_usernames)
+
+
+async def get_user_thread_async(db: _asyncio.AsyncSession, username: str):
+    result = await db.execute(_sql.select(_models.UserThread).where(_models.UserThread.username == username))
+    return result.scalars().first()
+
+
+async def get_user_threads_async(db: _asyncio.AsyncSession):
+    result = await db.execute(_sql.select(_models.UserThread))
+    return result.scalars().all()
+
+
+async def create_user_thread_async(db: _asyncio.AsyncSession, username: str, thread_id: str):
+    db_thread = _models.UserThread(username=username, thread_id=thread_id)
+    db.add(db_thread)
+    await db.commit()
+    await db.refresh(db_thread)
+    return db_thread
+
+
+async def get_cached_answers_async(db: _asyncio.AsyncSession, now: _dt.datetime, limit: int = 1024):
+    result = await db.execute(
+        _sql.select(_models.CachedAnswer)
+        .where(_models.CachedAnswer.expires_at > now)
+        .order_by(_models.CachedAnswer.expires_at.desc())
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+
+async def save_cached_answer_async(db: _asyncio.AsyncSession, key: str, prompt: str, answer: str,
+                                   expires_at: _dt.datetime):
+    result = await db.execute(_sql.select(_models.CachedAnswer).where(_models.CachedAnswer.key == key))
+    db_answer = result.scalars().first()
+    if db_answer is None:
+        db_answer = _models.CachedAnswer(key=key)
+        db.add(db_answer)
+    db_answer.prompt = prompt
+    db_answer.answer = answer
+    db_answer.expires_at = expires_at
+    await db.commit()
+    return db_answer
+
+
+async def delete_expired_answers_async(db: _asyncio.AsyncSession, now: _dt.datetime):
+    result = await db.execute(_sql.delete(_models.CachedAnswer).where(_models.CachedAnswer.expires_at <= now))
+    await db.commit()
+    return result.rowcount
+
+
+async def create_chat_message_async(db: _asyncio.AsyncSession, message_id: str, username: str, sender: str,
+                                    content: str, timestamp: _dt.datetime, thread_id: str = None):
+    db_message = _models.ChatMessage(
+        message_id=message_id,
+        username=username,
+        sender=sender,
+        content=content,
+        timestamp=timestamp,
+        thread_id=thread_id,
+    )
+    db.add(db_message)
+    await db.commit()
+    await db.refresh(db_message)
+    return db_message
+
+
+async def get_chat_message_async(db: _asyncio.AsyncSession, message_id: str):
+    result = await db.execute(_sql.select(_models.ChatMessage).where(_models.ChatMessage.message_id == message_id))
+    return result.scalars().first()
+
+
+async def get_chat_messages_async(db: _asyncio.AsyncSession, after: int = 0, limit: int = 50,
+                                  username: str = None):
+    query = _sql.select(_models.ChatMessage).where(_models.ChatMessage.id > after)
+    if username is not None:
+        query = query.where(_models.ChatMessage.username == username)
+    result = await db.execute(query.order_by(_models.ChatMessage.id).limit(limit))
+    return result.scalars().all()
+
+
+async def acquire_thread_lease_async(db: _asyncio.AsyncSession, thread_id: str, owner: str,
+                                     now: _dt.datetime, expires_at: _dt.datetime):
+    """Take the thread's lease if nobody holds it or the holder's lease expired."""
+    db.add(_models.ThreadLease(thread_id=thread_id, owner=owner, expires_at=expires_at))
+    try:
+        await db.commit()
+        return True
+    except _exc.IntegrityError:
+        await db.rollback()
+    result = await db.execute(
+        _sql.update(_models.ThreadLease)
+        .where(_models.ThreadLease.thread_id == thread_id, _models.ThreadLease.expires_at <= now)
+        .values(owner=owner, expires_at=expires_at)
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+
+async def release_thread_lease_async(db: _asyncio.AsyncSession, thread_id: str, owner: str):
+    await db.execute(
+        _sql.delete(_models.ThreadLease)
+        .where(_models.ThreadLease.thread_id == thread_id, _models.ThreadLease.owner == owner)
+    )
+    await db.commit()
+
+
+async def add_thread_usage_async(db: _asyncio.AsyncSession, thread_id: str, messages: int, tokens: int):
+    """Add to the thread's counts, returning the new (messages, tokens) totals."""
+    usage = _models.ThreadUsage
+    for _attempt in range(2):
+        result = await db.execute(
+            _sql.update(usage)
+            .where(usage.thread_id == thread_id)
+            .values(messages=usage.messages + messages, tokens=usage.tokens + tokens,
+                    updated_at=_dt.datetime.utcnow())
+        )
+        if result.rowcount == 0:
+            db.add(usage(thread_id=thread_id, messages=messages, tokens=tokens))
+        try:
+            await db.commit()
+            break
+        except _exc.IntegrityError:
+            # Another process inserted the first row; add to it instead
+            await db.rollback()
+    result = await db.execute(_sql.select(usage.messages, usage.tokens).where(usage.thread_id == thread_id))
+    return tuple(result.one())
+
+
+async def replace_user_thread_async(db: _asyncio.AsyncSession, username: str, old_thread_id: str,
+                                    new_thread_id: str):
+    """Point the user at `new_thread_id` if they are still on `old_thread_id`."""
+    result = await db.execute(
+        _sql.update(_models.UserThread)
+        .where(_models.UserThread.username == username, _models.UserThread.thread_id == old_thread_id)
+        .values(thread_id=new_thread_id, date_created=_dt.datetime.utcnow())
+    )
+    await db.commit()
+    return result.rowcount == 1
@@ -0,0 +1,201 @@
+#state.py
+
+import asyncio
+import collections
+import contextlib
+import datetime as _dt
+import itertools
+import os
+import uuid
+
+import sqlalchemy.exc as _exc
+
+import config as _config, database as _database, models as _models, services as _services
+
+
+class SharedState:
+    """State every worker process has to agree on.
+
+    Chat history, the user -> thread mapping, the size of each thread, and a
+    lease per thread so only one process runs the assistant on a thread at a
+    time. Whatever else the
+    app caches in-process is either immutable or expires on its own.
+    """
+
+    async def save_message(self, message, username: str):
+        """Persist a ChatMessage sent to `username`."""
+        raise NotImplementedError
+
+    async def get_message(self, message_id: str):
+        raise NotImplementedError
+
+    async def get_messages(self, after: int = 0, limit: int = 50, username: str = None):
+        """Messages with a cursor id above `after`, oldest first."""
+        raise NotImplementedError
+
+    async def get_thread(self, username: str):
+        raise NotImplementedError
+
+    async def claim_thread(self, username: str, thread_id: str) -> str:
+        """Map `username` to `thread_id` unless it is mapped already; returns the mapped thread."""
+        raise NotImplementedError
+
+    async def replace_thread(self, username: str, old_thread_id: str, new_thread_id: str) -> bool:
+        """Move `username` to `new_thread_id`, unless they left `old_thread_id` already."""
+        raise NotImplementedError
+
+    def thread_lease(self, thread_id: str):
+        """Async context manager held while writing to the thread."""
+        raise NotImplementedError
+
+    async def add_thread_usage(self, thread_id: str, messages: int, tokens: int):
+        """Count messages and tokens added to the thread; returns its (messages, tokens) totals."""
+        raise NotImplementedError
+
+
+class DatabaseState(SharedState):
+    """Shared state in the app database, safe across worker processes.
+
+    Thread leases are rows that expire after THREAD_LEASE_TTL seconds, so a
+    crashed worker cannot block a thread for longer than that.
+    """
+
+    async def save_message(self, message, username: str):
+        async with _database.AsyncSessionLocal() as db:
+            return await _services.create_chat_message_async(
+                db=db,
+                message_id=message.messageId,
+                username=username,
+                sender=message.sender,
+                content=message.content,
+                timestamp=message.timestamp,
+                thread_id=message.thread_id,
+            )
+
+    async def get_message(self, message_id: str):
+        async with _database.AsyncSessionLocal() as db:
+            return await _services.get_chat_message_async(db=db, message_id=message_id)
+
+    async def get_messages(self, after: int = 0, limit: int = 50, username: str = None):
+        async with _database.AsyncSessionLocal() as db:
+            return await _services.get_chat_messages_async(db=db, after=after, limit=limit, username=username)
+
+    async def get_thread(self, username: str):
+        async with _database.AsyncSessionLocal() as db:
+            db_thread = await _services.get_user_thread_async(db=db, username=username)
+            return db_thread.thread_id if db_thread else None
+
+    async def claim_thread(self, username: str, thread_id: str) -> str:
+        async with _database.AsyncSessionLocal() as db:
+            try:
+                db_thread = await _services.create_user_thread_async(db=db, username=username, thread_id=thread_id)
+                return db_thread.thread_id
+            except _exc.IntegrityError:
+                # Another process registered this user first; its thread wins.
+                await db.rollback()
+                db_thread = await _services.get_user_thread_async(db=db, username=username)
+                return db_thread.thread_id
+
+    async def replace_thread(self, username: str, old_thread_id: str, new_thread_id: str) -> bool:
+        async with _database.AsyncSessionLocal() as db:
+            return await _services.replace_user_thread_async(
+                db=db, username=username, old_thread_id=old_thread_id, new_thread_id=new_thread_id
+            )
+
+    @contextlib.asynccontextmanager
+    async def thread_lease(self, thread_id: str):
+        owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+        delay = 0.05
+        while True:
+            now = _dt.datetime.utcnow()
+            expires_at = now + _dt.timedelta(seconds=_config.THREAD_LEASE_TTL)
+            async with _database.AsyncSessionLocal() as db:
+                if await _services.acquire_thread_lease_async(
+                    db=db, thread_id=thread_id, owner=owner, now=now, expires_at=expires_at
+                ):
+                    break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+        try:
+            yield
+        finally:
+            async with _database.AsyncSessionLocal() as db:
+                await _services.release_thread_lease_async(db=db, thread_id=thread_id, owner=owner)
+
+    async def add_thread_usage(self, thread_id: str, messages: int, tokens: int):
+        async with _database.AsyncSessionLocal() as db:
+            return await _services.add_thread_usage_async(db=db, thread_id=thread_id, messages=messages, tokens=tokens)
+
+
+class MemoryState(SharedState):
+    """Shared state in plain dicts, for tests and single-process runs only."""
+
+    def __init__(self):
+        self._messages = []
+        self._message_ids = {}
+        self._threads = {}
+        self._leases = collections.defaultdict(asyncio.Lock)
+        self._usage = collections.defaultdict(lambda: (0, 0))
+        self._ids = itertools.count(1)
+
+    async def save_message(self, message, username: str):
+        db_message = _models.ChatMessage(
+            id=next(self._ids),
+            message_id=message.messageId,
+            username=username,
+            sender=message.sender,
+            content=message.content,
+            timestamp=message.timestamp,
+            thread_id=message.thread_id,
+        )
+        self._messages.append(db_message)
+        self._message_ids[db_message.message_id] = db_message
+        return db_message
+
+    async def get_message(self, message_id: str):
+        return self._message_ids.get(message_id)
+
+    async def get_messages(self, after: int = 0, limit: int = 50, username: str = None):
+        # Ids count up from 1, so message `id` is at index id - 1
+        messages = (m for m in self._messages[max(after, 0):] if username is None or m.username == username)
+        return list(itertools.islice(messages, limit))
+
+    async def get_thread(self, username: str):
+        return self._threads.get(username)
+
+    async def claim_thread(self, username: str, thread_id: str) -> str:
+        return self._threads.setdefault(username, thread_id)
+
+    async def replace_thread(self, username: str, old_thread_id: str, new_thread_id: str) -> bool:
+        if self._threads.get(username) != old_thread_id:
+            return False
+        self._threads[username] = new_thread_id
+        return True
+
+    @contextlib.asynccontextmanager
+    async def thread_lease(self, thread_id: str):
+        async with self._leases[thread_id]:
+            yield
+
+    async def add_thread_usage(self, thread_id: str, messages: int, tokens: int):
+        total_messages, total_tokens = self._usage[thread_id]
+        self._usage[thread_id] = (total_messages + messages, total_tokens + tokens)
+        return self._usage[thread_id]
+
+
+def build() -> SharedState:
+    """The implementation selected by SHARED_STATE."""
+    if _config.SHARED_STATE == "database":
+        return DatabaseState()
+    if _config.SHARED_STATE == "memory":
+        return MemoryState()
+    raise ValueError(f"Unknown SHARED_STATE {_config.SHARED_STATE!r}, expected database or memory")
+
+
+store = build()
+
+
+def use(shared_state: SharedState):
+    """Swap the shared state, e.g. for a MemoryState in tests."""
+    global store
+    store = shared_state
@@ -0,0 +1,71 @@
+#conftest.py
+
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+# Before any app module reads config: no OpenAI, no guardrails models, a throwaway database
+_tmp = tempfile.mkdtemp(prefix="chat-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/test.db")
+os.environ.setdefault("ASSISTANT_BACKEND", "fake")
+os.environ.setdefault("GUARD_BACKEND", "local")
+os.environ.setdefault("SHARED_STATE", "memory")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("PROFILE_DIR", f"{_tmp}/profiles")
+
+
+@pytest.fixture
+def run():
+    """Run a test scenario on a fresh event loop, leaving no pooled connections tied to it."""
+    import database as _database
+
+    def run(coro):
+        async def scenario():
+            try:
+                return await coro
+            finally:
+                await _database.async_engine.dispose()
+
+        return asyncio.run(scenario())
+
+    return run
+
+
+@pytest.fixture(scope="session")
+def app():
+    """The main module, with its database set up."""
+    import main
+    main.setup_database()
+    return main
+
+
+@pytest.fixture(scope="session")
+def token_for(app):
+    """Make a user, if needed, and return a bearer token for them."""
+    import auth as _auth, database as _database, schemas as _schemas, services as _services
+
+    def token_for(username: str) -> str:
+        db = _database.SessionLocal()
+        try:
+            user = _services.get_user_by_username(db=db, username=username)
+            if user is None:
+                user = _services.create_user(
+                    db=db, user=_schemas.UserCreate(username=username, password="secret"), password_hash="unused"
+                )
+            return _auth.create_access_token(user)
+        finally:
+            db.close()
+
+    return token_for
+
+
+@pytest.fixture
+def fake_backend(app, monkeypatch):
+    """The app's FakeBackend, answering in five words after `latency` seconds."""
+    backend = app.backend
+    monkeypatch.setattr(backend, "latency", 0.05)
+    monkeypatch.setattr(backend, "tokens_per_second", 0)
+    monkeypatch.setattr(backend, "reply_tokens", 5)
+    return backend
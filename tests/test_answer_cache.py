@@ -0,0 +1,36 @@
+#test_answer_cache.py
+
+import asyncio
+
+import httpx
+
+import answer_cache as _answer_cache
+import config as _config
+
+
+def test_coalesced_replies_are_not_cached(app, token_for, fake_backend, monkeypatch, run):
+    monkeypatch.setattr(_config, "ANSWER_CACHE_ENABLED", True)
+    monkeypatch.setattr(_config, "ANSWER_CACHE_PERSIST", False)
+    monkeypatch.setattr(fake_backend, "latency", 0.3)
+    headers = {"Authorization": f"Bearer {token_for('cache_user')}"}
+    alone = "how do I plant beans in the dry season"
+    coalesced = ["how do I plant sorghum", "when should sorghum be weeded"]
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            async def ask(content):
+                return await client.post("/chats", headers=headers, json={"sender": "cache_user", "content": content})
+
+            first = asyncio.ensure_future(ask(alone))
+            while app.scheduler.stats()["active_threads"] == 0:
+                await asyncio.sleep(0.01)
+            # Both arrive mid-run and share the follow-up run
+            responses = await asyncio.gather(first, *(ask(content) for content in coalesced))
+            assert [response.status_code for response in responses] == [201] * 3
+            await asyncio.sleep(0.05)  # answers are cached in the background
+
+    run(scenario())
+    assert _answer_cache.get(alone) is not None
+    for content in coalesced:
+        assert _answer_cache.get(content) is None
@@ -0,0 +1,22 @@
+#test_auth.py
+
+import asyncio
+
+import jwt
+
+import auth as _auth
+import config as _config
+
+
+def test_passwords_are_checked_after_a_shutdown():
+    # As after a second lifespan in the same process
+    _auth.shutdown()
+    password_hash = asyncio.run(_auth.hash_password("secret"))
+    _auth.shutdown()
+    assert asyncio.run(_auth.verify_password("secret", password_hash))
+
+
+def test_access_tokens_carry_only_the_username_and_expiry(app, token_for):
+    payload = jwt.decode(token_for("claims_user"), _config.JWT_SECRET, algorithms=["HS256"])
+    assert set(payload) == {"username", "exp"}
+    assert _auth.verify_token(token_for("claims_user")) == "claims_user"
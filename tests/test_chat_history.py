@@ -0,0 +1,31 @@
+#test_chat_history.py
+
+import httpx
+
+
+def test_history_is_private_to_its_user(app, token_for, fake_backend, run):
+    alice = {"Authorization": f"Bearer {token_for('history_alice')}"}
+    bob = {"Authorization": f"Bearer {token_for('history_bob')}"}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            reply = await client.post("/chats", headers=alice, json={"sender": "history_alice",
+                                                                     "content": "how do I plant maize"})
+            assert reply.status_code == 201
+            message_id = reply.json()["messageId"]
+
+            assert (await client.get("/chats")).status_code == 401
+            assert (await client.get(f"/chats/{message_id}")).status_code == 401
+
+            own = await client.get("/chats", headers=alice, params={"limit": 500})
+            assert message_id in [message["messageId"] for message in own.json()]
+            assert (await client.get(f"/chats/{message_id}", headers=alice)).status_code == 200
+
+            # Neither the list nor a direct lookup shows another user's messages
+            other = await client.get("/chats", headers=bob, params={"limit": 500, "username": "history_alice"})
+            assert other.status_code == 200
+            assert message_id not in [message["messageId"] for message in other.json()]
+            assert (await client.get(f"/chats/{message_id}", headers=bob)).status_code == 404
+
+    run(scenario())
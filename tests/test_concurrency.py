@@ -0,0 +1,46 @@
+#test_concurrency.py
+
+import asyncio
+import time
+
+import httpx
+
+SLOW_RUN_SECONDS = 1.5
+# Generous for a loaded CI machine, far below SLOW_RUN_SECONDS
+FAST_BOUND_SECONDS = 0.25
+
+
+def test_fast_endpoints_stay_fast_while_slow_runs_are_pending(app, token_for, fake_backend, monkeypatch, run):
+    monkeypatch.setattr(fake_backend, "latency", SLOW_RUN_SECONDS)
+    users = [f"slow{index}" for index in range(6)]
+    headers = {user: {"Authorization": f"Bearer {token_for(user)}"} for user in users}
+
+    async def all_runs_started(count):
+        while app.scheduler.stats()["active_threads"] < count:
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            slow = [
+                asyncio.ensure_future(client.post(
+                    "/chats", headers=headers[user],
+                    json={"sender": user, "content": "how do I plant maize", "use_cache": False},
+                ))
+                for user in users
+            ]
+            # Every run is on the fake assistant at once, unless runs block the loop
+            await asyncio.wait_for(all_runs_started(len(users)), SLOW_RUN_SECONDS)
+
+            for path in ("/healthz", "/chats"):
+                started = time.perf_counter()
+                response = await client.get(path, headers=headers[users[0]])
+                elapsed = time.perf_counter() - started
+                assert response.status_code == 200
+                assert elapsed < FAST_BOUND_SECONDS, f"{path} took {elapsed:.3f}s behind slow runs"
+                assert not any(request.done() for request in slow)
+
+            responses = await asyncio.gather(*slow)
+        assert [response.status_code for response in responses] == [201] * len(users)
+
+    run(scenario())
@@ -0,0 +1,37 @@
+#test_guard.py
+
+import asyncio
+import concurrent.futures as _futures
+import threading
+import types
+
+import guard as _guard
+
+
+def test_output_checks_are_counted_and_do_not_hold_up_prompts(monkeypatch):
+    release = threading.Event()
+    input_pool = _futures.ThreadPoolExecutor(max_workers=1)
+    output_pool = _futures.ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(_guard, "_built_fingerprint", _guard.config_fingerprint())
+    monkeypatch.setattr(_guard, "_guard", types.SimpleNamespace(validate=lambda text: release.wait(5)))
+    monkeypatch.setattr(_guard, "_validate", lambda text: None)
+    monkeypatch.setattr(_guard, "_executor", input_pool)
+    monkeypatch.setattr(_guard, "_output_executor", output_pool)
+
+    async def scenario():
+        sentences = [asyncio.ensure_future(_guard.validate_output(f"slow sentence {index}.")) for index in range(3)]
+        await asyncio.sleep(0.05)
+        depths = _guard.output_queue_depth(), _guard.queue_depth()
+        # The output worker is busy, the prompt still gets the input worker
+        await asyncio.wait_for(_guard.validate("a prompt checked while replies are"), 1)
+        release.set()
+        await asyncio.gather(*sentences)
+        return depths
+
+    try:
+        assert asyncio.run(scenario()) == (3, 0)
+        assert _guard.output_queue_depth() == 0
+    finally:
+        release.set()
+        input_pool.shutdown()
+        output_pool.shutdown()
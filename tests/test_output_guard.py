@@ -0,0 +1,42 @@
+#test_output_guard.py
+
+import asyncio
+
+import assistant as _assistant
+import config as _config
+import guard as _guard
+import run_scheduler as _run_scheduler
+
+THREAD = "thread_test"
+
+
+async def fail_on_crop3(text):
+    if "crop3" in text:
+        raise ValueError("NSFW")
+
+
+def test_a_stopped_reply_cancels_its_run_before_the_next_one(monkeypatch):
+    monkeypatch.setattr(_config, "OUTPUT_GUARD", "stop")
+    monkeypatch.setattr(_config, "OUTPUT_GUARD_MAX_CHARS", 12)
+    monkeypatch.setattr(_guard, "output_checks_enabled", lambda: True)
+    monkeypatch.setattr(_guard, "validate_output", fail_on_crop3)
+    # Like an OpenAI run, a FakeBackend run whose stream is dropped stays active
+    backend = _assistant.FakeBackend(latency=0.01, tokens_per_second=200, reply_tokens=40, citation_every=0)
+    backend.threads[THREAD] = []
+    scheduler = _run_scheduler.RunScheduler(backend.add_message, backend.stream_reply)
+
+    async def scenario():
+        first = scheduler.submit(THREAD, "prompt 0")
+        first_reply = "".join([delta async for delta in first.stream()])
+        second = scheduler.submit(THREAD, "prompt 1")
+        return first_reply, "".join([delta async for delta in second.stream()])
+
+    first_reply, second_reply = asyncio.run(scenario())
+    assert first_reply.rstrip().endswith(_config.OUTPUT_GUARD_NOTICE)
+    assert "crop4" not in first_reply
+    # Stopped again, but only after the new message reached the thread
+    assert second_reply.rstrip().endswith(_config.OUTPUT_GUARD_NOTICE)
+    assert [message["content"] for message in backend.threads[THREAD] if message["role"] == "user"] == [
+        "prompt 0", "prompt 1",
+    ]
+    assert THREAD not in backend._active
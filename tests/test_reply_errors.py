@@ -0,0 +1,55 @@
+#test_reply_errors.py
+
+import asyncio
+
+import httpx
+import pytest
+from starlette.testclient import TestClient
+
+import database as _database
+
+
+@pytest.fixture
+def failing_backend(fake_backend, monkeypatch):
+    """The app's FakeBackend, failing every run after its first word."""
+    stream_run = type(fake_backend).stream_run
+
+    async def failing_stream_run(thread_id):
+        async for delta in stream_run(fake_backend, thread_id):
+            yield delta
+            await fake_backend.cancel_run(thread_id)
+            raise RuntimeError("assistant failed")
+
+    monkeypatch.setattr(fake_backend, "stream_run", failing_stream_run)
+    return fake_backend
+
+
+def test_a_failed_reply_ends_with_an_error_frame(app, token_for, failing_backend):
+    try:
+        with TestClient(app.app).websocket_connect(f"/ws?token={token_for('ws_error_user')}") as websocket:
+            websocket.send_json({"type": "message", "content": "how do I plant maize", "client_id": "c1"})
+            while True:
+                frame = websocket.receive_json()
+                if frame["type"] != "delta":
+                    break
+    finally:
+        # The test client ran the app on its own event loop
+        asyncio.run(_database.async_engine.dispose())
+    assert frame == {"type": "error", "client_id": "c1", "status": 502, "detail": app.ASSISTANT_FAILED}
+
+
+def test_a_failed_streamed_reply_ends_with_an_error_event(app, token_for, failing_backend, run):
+    headers = {"Authorization": f"Bearer {token_for('sse_error_user')}"}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/chats/stream", headers=headers,
+                                         json={"sender": "sse_error_user", "content": "how do I plant maize"})
+            return response.status_code, response.text
+
+    status_code, body = run(scenario())
+    assert status_code == 200
+    events = [frame.split("\n") for frame in body.strip().split("\n\n")]
+    assert events[0][0] == "event: delta"
+    assert events[-1] == ["event: error", 'data: {"status": 502, "detail": "%s"}' % app.ASSISTANT_FAILED]
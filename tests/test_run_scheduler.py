@@ -0,0 +1,117 @@
+#test_run_scheduler.py
+
+import asyncio
+import contextlib
+
+import assistant as _assistant
+import background as _background
+import run_scheduler as _run_scheduler
+
+THREAD = "thread_test"
+
+
+def make_backend(**options):
+    # FakeBackend raises on a second run, or a new message, while a run is active
+    settings = dict(latency=0.05, tokens_per_second=0, reply_tokens=3, citation_every=0)
+    settings.update(options)
+    backend = _assistant.FakeBackend(**settings)
+    backend.threads[THREAD] = []
+    return backend
+
+
+async def reply(batch):
+    return "".join([delta async for delta in batch.stream()])
+
+
+def test_rapid_prompts_coalesce_into_two_runs():
+    backend = make_backend()
+    scheduler = _run_scheduler.RunScheduler(backend.add_message, backend.stream_run)
+
+    async def scenario():
+        batches = [scheduler.submit(THREAD, f"prompt {index}") for index in range(5)]
+        replies = await asyncio.gather(*(reply(batch) for batch in batches))
+        return batches, replies
+
+    batches, replies = asyncio.run(scenario())
+    assert scheduler.stats()["runs"] == 2
+    assert scheduler.stats()["coalesced_messages"] == 3
+    # Nothing is kept for a thread once it is idle
+    assert scheduler.stats()["thread_locks"] == 0
+    assert batches[0].prompts == ["prompt 0"]
+    assert all(batch is batches[1] for batch in batches[1:])
+    assert batches[1].prompts == [f"prompt {index}" for index in range(1, 5)]
+    # Every prompt reached the thread, before the run that answers it
+    roles = [(message["role"], message["content"]) for message in backend.threads[THREAD]]
+    assert [content for role, content in roles if role == "user"] == [f"prompt {index}" for index in range(5)]
+    assert [role for role, _ in roles] == ["user", "assistant", "user", "user", "user", "user", "assistant"]
+
+
+def test_every_waiter_gets_its_runs_reply():
+    backend = make_backend()
+    scheduler = _run_scheduler.RunScheduler(backend.add_message, backend.stream_run)
+
+    async def scenario():
+        batches = [scheduler.submit(THREAD, f"prompt {index}") for index in range(4)]
+        # Late subscribers still see the deltas sent before they subscribed
+        await asyncio.sleep(0.02)
+        return batches, await asyncio.gather(*(reply(batch) for batch in batches))
+
+    batches, replies = asyncio.run(scenario())
+    assert replies[0] == "".join(batches[0].deltas) != ""
+    assert replies[1:] == ["".join(batches[1].deltas)] * 3
+    assert [message["content"] for message in backend.threads[THREAD] if message["role"] == "assistant"] == [
+        replies[0], replies[1],
+    ]
+
+
+class FailingBackend(_assistant.FakeBackend):
+    """Fails its first run after one delta."""
+
+    failures = 1
+
+    async def stream_run(self, thread_id):
+        async with contextlib.aclosing(super().stream_run(thread_id)) as deltas:
+            async for delta in deltas:
+                yield delta
+                if self.failures:
+                    self.failures -= 1
+                    # A failed run is over, unlike one whose stream was merely dropped
+                    await self.cancel_run(thread_id)
+                    raise RuntimeError("assistant failed")
+
+
+def test_a_failing_run_fails_all_its_waiters_and_the_next_run_goes_ahead():
+    backend = FailingBackend(latency=0.05, tokens_per_second=0, reply_tokens=3, citation_every=0)
+    scheduler = _run_scheduler.RunScheduler(backend.add_message, backend.stream_run)
+
+    async def scenario():
+        first = scheduler.submit(THREAD, "prompt 0")
+        pending = [scheduler.submit(THREAD, f"prompt {index}") for index in (1, 2)]
+        # Two waiters on the failing run, two on the one after it
+        return await asyncio.gather(reply(first), reply(first), *(reply(batch) for batch in pending),
+                                    return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert [str(result) for result in results[:2]] == ["assistant failed"] * 2
+    assert results[2] == results[3] and isinstance(results[2], str) and results[2]
+    assert scheduler.stats()["runs"] == 2
+
+
+def test_cancelling_the_driver_fails_running_and_pending_waiters():
+    backend = make_backend(latency=5)
+    scheduler = _run_scheduler.RunScheduler(backend.add_message, backend.stream_run)
+
+    async def scenario():
+        running = scheduler.submit(THREAD, "prompt 0")
+        pending = scheduler.submit(THREAD, "prompt 1")
+        waiters = [asyncio.ensure_future(reply(batch)) for batch in (running, pending)]
+        await asyncio.sleep(0.05)
+        (driver,) = [task for task in _background._tasks if task.get_coro().__name__ == "_drive"]
+        driver.cancel()
+        results = await asyncio.wait_for(asyncio.gather(*waiters, return_exceptions=True), 1)
+        return results
+
+    results = asyncio.run(scenario())
+    assert [str(result) for result in results] == ["Assistant run was cancelled"] * 2
+    assert scheduler.stats()["active_threads"] == 0
+    assert scheduler.stats()["pending_batches"] == 0
@@ -0,0 +1,24 @@
+#test_thread_registry.py
+
+import asyncio
+
+import thread_registry as _thread_registry
+
+
+def test_concurrent_first_messages_share_one_thread_and_leave_no_lock(app):
+    created = []
+
+    async def create_thread():
+        await asyncio.sleep(0.01)
+        created.append(f"thread_registry_{len(created)}")
+        return created[-1]
+
+    async def scenario():
+        return await asyncio.gather(*(
+            _thread_registry.get_or_create_thread("registry_user", create_thread) for _ in range(5)
+        ))
+
+    assert asyncio.run(scenario()) == ["thread_registry_0"] * 5
+    assert created == ["thread_registry_0"]
+    assert "registry_user" not in _thread_registry._locks
+    assert _thread_registry.owner("thread_registry_0") == "registry_user"
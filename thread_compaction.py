@@ -0,0 +1,126 @@
+#thread_compaction.py
+
+import collections
+import logging
+import time
+
+import config as _config, metrics as _metrics, state as _state, thread_registry as _thread_registry
+
+logger = logging.getLogger(__name__)
+
+# Thread lengths, in messages, the run latency report is broken down by
+LENGTH_BUCKETS = (10, 25, 50, 100, 200)
+SUMMARY_PREFIX = "Summary of our earlier conversation:\n"
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly 4 characters per token for English text; no tokenizer needed
+    return (len(text) + 3) // 4
+
+
+def length_label(messages: int) -> str:
+    lower = 0
+    for bound in LENGTH_BUCKETS:
+        if messages < bound:
+            return f"{lower}-{bound - 1}"
+        lower = bound
+    return f"{lower}+"
+
+
+class Compactor:
+    """Keeps assistant threads short by moving users onto summarized fresh threads.
+
+    Every run on a thread adds its prompts and reply to the thread's message
+    and token counts in the shared state. Once a thread passes
+    THREAD_MAX_MESSAGES or THREAD_MAX_TOKENS, its owner is moved, in the
+    background, to a new thread that starts with a summary of the old one.
+    The summary is written without touching the old thread; only copying the
+    messages added meanwhile and switching the user happen under the
+    thread's lock, so no request waits for the summary.
+
+    `lock(thread_id)` is the async context manager the run scheduler holds
+    while writing to a thread.
+    """
+
+    def __init__(self, backend, lock):
+        self.backend = backend
+        self.lock = lock
+        self._compacting = set()
+        self.compactions = 0
+        self.failures = 0
+        # Thread length bucket -> [runs, total seconds]
+        self._latency = collections.defaultdict(lambda: [0, 0.0])
+
+    async def record_run(self, thread_id: str, prompts, reply: str, seconds: float):
+        """Count a finished run; starts a compaction when the thread got too long."""
+        messages, tokens = await _state.store.add_thread_usage(
+            thread_id, len(prompts) + 1, sum(estimate_tokens(prompt) for prompt in prompts) + estimate_tokens(reply)
+        )
+        # The run saw everything but its own reply
+        label = length_label(messages - 1)
+        _metrics.THREAD_RUN_LATENCY.observe(seconds, thread_messages=label)
+        latency = self._latency[label]
+        latency[0] += 1
+        latency[1] += seconds
+
+        if not self.is_too_long(messages, tokens) or thread_id in self._compacting:
+            return
+        username = _thread_registry.owner(thread_id)
+        if username is None:
+            return
+        self._compacting.add(thread_id)
+        try:
+            await self.compact(username, thread_id)
+        finally:
+            self._compacting.discard(thread_id)
+
+    @staticmethod
+    def is_too_long(messages: int, tokens: int) -> bool:
+        return (0 < _config.THREAD_MAX_MESSAGES <= messages) or (0 < _config.THREAD_MAX_TOKENS <= tokens)
+
+    async def compact(self, username: str, thread_id: str):
+        """Move `username` from `thread_id` to a new thread seeded with its summary."""
+        if await _state.store.get_thread(username) != thread_id:
+            # Moved already, by another worker process
+            _metrics.THREAD_COMPACTIONS.inc(outcome="skipped")
+            return
+        started = time.perf_counter()
+        try:
+            messages = await self.backend.list_messages(thread_id)
+            summary = SUMMARY_PREFIX + await self.backend.summarize(messages)
+            new_thread_id = await self.backend.create_thread()
+            await self.backend.add_message(new_thread_id, summary, role="assistant")
+            async with self.lock(thread_id):
+                # Exchanges that finished while the summary was written move over verbatim
+                tail = await self.backend.list_messages(thread_id, after=messages[-1]["id"]) if messages else []
+                for message in tail:
+                    await self.backend.add_message(new_thread_id, message["content"], role=message["role"])
+                if not await _state.store.replace_thread(username, thread_id, new_thread_id):
+                    _metrics.THREAD_COMPACTIONS.inc(outcome="skipped")
+                    return
+                _thread_registry.replace(username, thread_id, new_thread_id)
+            await _state.store.add_thread_usage(
+                new_thread_id, 1 + len(tail),
+                estimate_tokens(summary) + sum(estimate_tokens(message["content"]) for message in tail),
+            )
+        except Exception:
+            self.failures += 1
+            _metrics.THREAD_COMPACTIONS.inc(outcome="failed")
+            logger.exception("Compacting thread %s of %s failed", thread_id, username)
+            return
+        self.compactions += 1
+        _metrics.THREAD_COMPACTIONS.inc(outcome="compacted")
+        logger.info("Moved %s from thread %s (%d messages) to %s in %.1fs", username, thread_id,
+                    len(messages), new_thread_id, time.perf_counter() - started)
+
+    def stats(self):
+        return {
+            "compactions": self.compactions,
+            "failures": self.failures,
+            "in_progress": len(self._compacting),
+            "run_latency_by_thread_length": {
+                label: {"runs": self._latency[label][0],
+                        "mean_seconds": round(self._latency[label][1] / self._latency[label][0], 3)}
+                for label in map(length_label, (0,) + LENGTH_BUCKETS) if label in self._latency
+            },
+        }
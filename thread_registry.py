@@ -0,0 +1,86 @@
+#thread_registry.py
+
+import asyncio
+import json
+import os
+
+import cache as _cache, config as _config, database as _database, services as _services, state as _state
+
+# username -> thread_id, filled on lookup. Compaction moves users to new threads,
+# which other worker processes pick up once their entry expires.
+_threads = _cache.TTLCache(maxsize=_config.USER_CACHE_SIZE, ttl=_config.THREAD_CACHE_TTL)
+# thread_id -> username, for the threads this process has looked up lately;
+# refreshed on every lookup, so it outlives any run on the thread
+_owners = _cache.TTLCache(maxsize=_config.USER_CACHE_SIZE, ttl=_config.THREAD_LEASE_TTL)
+# username -> lock, so concurrent first messages create a single thread; only
+# kept while a lookup is going to the store
+_locks = {}
+
+
+def peek_thread(username: str):
+    """The user's thread id if it is already cached, without touching the DB."""
+    return _threads.get(username)
+
+
+async def get_or_create_thread(username: str, create_thread):
+    """Return the user's thread id, calling `create_thread()` at most once per user."""
+    thread_id = _threads.get(username)
+    if thread_id:
+        _owners.set(thread_id, username)
+        return thread_id
+
+    lock = _locks.setdefault(username, asyncio.Lock())
+    try:
+        async with lock:
+            thread_id = _threads.get(username)
+            if thread_id:
+                return thread_id
+
+            thread_id = await _state.store.get_thread(username)
+            if not thread_id:
+                thread_id = await create_thread()
+                # Another process may have registered this user first; its thread wins.
+                thread_id = await _state.store.claim_thread(username, thread_id)
+            _threads.set(username, thread_id)
+            _owners.set(thread_id, username)
+            return thread_id
+    finally:
+        # Anyone still waiting holds this lock object and finds the thread cached
+        if not lock.locked() and _locks.get(username) is lock:
+            del _locks[username]
+
+
+def owner(thread_id: str):
+    """The user a thread belongs to, if this process has looked it up."""
+    return _owners.get(thread_id)
+
+
+def replace(username: str, old_thread_id: str, new_thread_id: str):
+    """Record that `username` moved from `old_thread_id` to `new_thread_id`."""
+    _threads.set(username, new_thread_id)
+    _owners.pop(old_thread_id)
+    _owners.set(new_thread_id, username)
+
+
+def import_json_threads(path: str = "user_threads.json"):
+    """Import the legacy user_threads.json mapping.
+
+    Users that already have a row are left alone, so running this on every
+    startup only ever imports a mapping once. Returns the number imported.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r") as file:
+        user_threads = json.load(file)
+
+    db = _database.SessionLocal()
+    try:
+        known = {db_thread.username for db_thread in _services.get_user_threads(db=db)}
+        imported = 0
+        for username, thread_id in user_threads.items():
+            if thread_id and username not in known:
+                _services.create_user_thread(db=db, username=username, thread_id=thread_id)
+                imported += 1
+        return imported
+    finally:
+        db.close()
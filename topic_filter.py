@@ -0,0 +1,126 @@
+#topic_filter.py
+
+import re
+import threading
+
+ACCEPT = "accept"
+REJECT = "reject"
+AMBIGUOUS = "ambiguous"
+
+# Words that say something is about farming in Uganda without naming a
+# configured topic outright. Keys are stems of topics in config.py.
+RELATED_TERMS = {
+    "farm": [
+        "agriculture", "farmer", "harvest", "soil", "seed", "seedling", "fertilizer",
+        "manure", "compost", "irrigation", "irrigate", "weed", "pest", "pesticide",
+        "livestock", "cattle", "goat", "poultry", "chicken", "garden", "acre", "yield",
+        "hoe", "tractor", "greenhouse", "rain", "season", "drought", "grow",
+        "cow", "calf", "heifer", "dairy", "milk", "pig", "sheep", "tick", "vet",
+        "orchard", "tree", "blight", "fungus",
+    ],
+    "crop": [
+        "maize", "corn", "bean", "cassava", "banana", "matooke", "coffee", "tea",
+        "sorghum", "millet", "groundnut", "potato", "rice", "tomato", "cabbage",
+        "onion", "sugarcane", "cotton", "tobacco", "vegetable", "fruit", "avocado",
+        "mango", "pineapple", "sunflower", "soybean", "simsim",
+    ],
+    "plant": ["sow", "spacing", "germinate", "germination", "transplant", "prune", "nursery"],
+    "uganda": [
+        "kampala", "jinja", "gulu", "mbarara", "masaka", "busoga", "buganda", "elgon",
+        "kenya", "africa", "district", "village", "shilling", "ugx",
+    ],
+}
+
+# Words that put a message clearly outside farming. A message is only rejected
+# locally with one of these and no farming word, and never accepted locally with
+# one; everything else unsure goes to the LLM.
+OFF_TOPIC_TERMS = [
+    "football", "soccer", "basketball", "movie", "film", "song", "music", "singer",
+    "celebrity", "bitcoin", "crypto", "forex", "politic", "election", "president",
+    "betting", "lottery", "casino", "dating", "girlfriend", "boyfriend", "videogame",
+    "homework", "essay", "poem", "joke", "iphone", "laptop", "programming", "python",
+    "javascript", "recipe",
+]
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "if", "of", "to", "in", "on", "at", "for",
+    "with", "by", "from", "is", "are", "was", "were", "be", "been", "it", "its", "i",
+    "me", "my", "you", "your", "we", "our", "they", "them", "he", "she", "this",
+    "that", "these", "those", "do", "does", "did", "can", "could", "should", "would",
+    "will", "how", "what", "when", "where", "which", "who", "why", "there", "here",
+    "so", "as", "about", "please", "tell", "know", "want", "get", "some", "any",
+}
+
+_WORD = re.compile(r"[a-z]+")
+
+
+def stem(word: str) -> str:
+    """Very small suffix stripper; enough to fold plurals and -ing/-ed forms."""
+    for suffix in ("ings", "ing", "ers", "ed"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[: -len(suffix)]
+            if len(word) > 3 and word[-1] == word[-2]:
+                # planning -> plann -> plan; "sell" or "grass" are left alone
+                word = word[:-1]
+            return word
+    if word.endswith("es") and word[-3:-2] in ("s", "x", "z", "h", "o") and len(word) >= 5:
+        # boxes -> box, tomatoes -> tomato; but trees -> tree
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss") and len(word) >= 4:
+        return word[:-1]
+    return word
+
+
+def content_words(text: str):
+    return [stem(word) for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+class TopicClassifier:
+    """Cheap first tier in front of the LLM-backed RestrictToTopic validator.
+
+    A message is accepted with at least `accept_min_words` topic or related
+    words, making up at least `accept_score` of its content words, and no
+    OFF_TOPIC_TERMS word. It is only rejected on positive evidence: at least
+    `reject_min_words` content words, an OFF_TOPIC_TERMS word and no topic or
+    related word at all. Anything else, including a farming word next to an
+    off-topic one and farming questions in words the tables do not know, is
+    ambiguous and should go to the LLM.
+    """
+
+    def __init__(self, valid_topics, accept_score: float = 0.2, reject_min_words: int = 4,
+                 accept_min_words: int = 2):
+        self.topics = {stem(word) for topic in valid_topics for word in content_words(topic)}
+        self.related = set()
+        for topic in self.topics:
+            self.related.update(stem(word) for word in RELATED_TERMS.get(topic, []))
+        self.off_topic = {stem(word) for word in OFF_TOPIC_TERMS}
+        self.accept_score = accept_score
+        self.accept_min_words = accept_min_words
+        self.reject_min_words = reject_min_words
+        self._lock = threading.Lock()
+        self._counts = {ACCEPT: 0, REJECT: 0, AMBIGUOUS: 0}
+
+    def classify(self, text: str) -> str:
+        words = content_words(text)
+        farming = sum(1 for word in words if word in self.topics or word in self.related)
+        off_topic = any(word in self.off_topic for word in words)
+        if off_topic:
+            # A farming word does not clear an off-topic one: "a poem about uganda football"
+            verdict = REJECT if farming == 0 and len(words) >= self.reject_min_words else AMBIGUOUS
+        elif farming >= self.accept_min_words and farming / len(words) >= self.accept_score:
+            verdict = ACCEPT
+        else:
+            verdict = AMBIGUOUS
+        with self._lock:
+            self._counts[verdict] += 1
+        return verdict
+
+    def stats(self):
+        """Verdict counts per tier outcome and the share each one takes."""
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        return {
+            "counts": counts,
+            "ratios": {verdict: (count / total if total else 0.0) for verdict, count in counts.items()},
+        }
@@ -0,0 +1,133 @@
+#ws_connection.py
+
+import asyncio
+import contextlib
+import json
+import logging
+import time
+
+from fastapi.encoders import jsonable_encoder
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+import config as _config
+
+logger = logging.getLogger(__name__)
+
+# Close codes in the application range
+HEARTBEAT_TIMEOUT = 4408
+SLOW_CONSUMER = 4429
+
+_open = set()
+
+
+class Closed(Exception):
+    """The connection is closed; nothing more can be sent on it."""
+
+
+class Connection:
+    """One accepted WebSocket with a bounded send buffer and a heartbeat.
+
+    send() queues a frame for the writer task and waits while the buffer is
+    full, so producers slow down to the client's pace. A client that accepts
+    nothing for WS_SEND_TIMEOUT seconds is disconnected instead of growing
+    the buffer. The server pings every WS_HEARTBEAT_INTERVAL seconds and
+    closes connections that sent nothing for WS_HEARTBEAT_TIMEOUT seconds.
+    """
+
+    def __init__(self, websocket: WebSocket, username: str):
+        self.websocket = websocket
+        self.username = username
+        self.last_received = time.monotonic()
+        self.closed = False
+        self._buffer = asyncio.Queue(maxsize=_config.WS_SEND_BUFFER)
+        self._tasks = set()
+
+    async def send(self, frame: dict):
+        if self.closed:
+            raise Closed()
+        try:
+            await asyncio.wait_for(self._buffer.put(frame), _config.WS_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            await self.close(SLOW_CONSUMER, "Send buffer full")
+            raise Closed()
+
+    async def _write(self):
+        while True:
+            frame = await self._buffer.get()
+            try:
+                await self.websocket.send_text(json.dumps(jsonable_encoder(frame)))
+            except Exception as e:
+                # The client went away; the read loop notices it too
+                logger.debug("WebSocket send failed: %s", e)
+                self.closed = True
+                return
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(_config.WS_HEARTBEAT_INTERVAL)
+            if time.monotonic() - self.last_received > _config.WS_HEARTBEAT_TIMEOUT:
+                await self.close(HEARTBEAT_TIMEOUT, "Heartbeat timeout")
+                return
+            # Not through the buffer: a backed-up buffer must not delay the ping
+            with contextlib.suppress(Exception):
+                await self.websocket.send_text(json.dumps({"type": "ping"}))
+
+    def spawn(self, coro):
+        """Run `coro` for this connection; it is cancelled when the connection ends."""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None and not isinstance(task.exception(), Closed):
+            logger.error("WebSocket task failed", exc_info=task.exception())
+
+    async def receive(self) -> dict:
+        """The next JSON frame from the client; raises WebSocketDisconnect when it leaves."""
+        text = await self.websocket.receive_text()
+        self.last_received = time.monotonic()
+        return json.loads(text)
+
+    async def close(self, code: int = 1000, reason: str = None):
+        if self.closed:
+            return
+        self.closed = True
+        with contextlib.suppress(Exception):
+            await self.websocket.close(code=code, reason=reason)
+
+    async def serve(self, handle, start=None):
+        """Accept frames until the client leaves, passing each one to `handle(frame)`.
+
+        `start`, a coroutine, runs before the first frame is read.
+        """
+        _open.add(self)
+        writer = self.spawn(self._write())
+        self.spawn(self._heartbeat())
+        try:
+            if start is not None:
+                await start
+            while not self.closed:
+                try:
+                    frame = await self.receive()
+                except WebSocketDisconnect:
+                    break
+                except ValueError:
+                    await self.send({"type": "error", "status": 400, "detail": "Frames must be JSON objects"})
+                    continue
+                await handle(frame)
+        except (Closed, RuntimeError):
+            # RuntimeError: Starlette refuses to receive on a socket closed meanwhile
+            pass
+        finally:
+            self.closed = True
+            _open.discard(self)
+            for task in list(self._tasks):
+                if task is not writer:
+                    task.cancel()
+            writer.cancel()
+
+
+def open_connections() -> int:
+    return len(_open)